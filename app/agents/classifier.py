@@ -1,15 +1,122 @@
 import os
 import json
-import google.generativeai as genai
-from dotenv import load_dotenv
+import asyncio
+from agents.llm_client import generate, generate_async
+from agents.fast_classifier import fast_classify, get_fast_path_stats
+from memory.classification_cache import classification_cache, make_cache_key
+from utils.executors import run_blocking
+from utils.single_flight import SingleFlight
 
-load_dotenv()
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+# Bump whenever the prompt below changes so stale cached results are not reused
+PROMPT_VERSION = "v1"
+# Inputs packed into one LLM call by classify_batch
+CLASSIFIER_BATCH_SIZE = int(os.getenv("CLASSIFIER_BATCH_SIZE", "20"))
 
-model = genai.GenerativeModel(model_name="models/gemini-2.0-flash")
+# Identical inputs classified concurrently share one cache lookup and LLM call
+_classify_flight = SingleFlight()
 
 def classify_input(input_text: str) -> dict:
-    prompt = f"""
+    fast_result = fast_classify(input_text)
+    if fast_result is not None:
+        return fast_result
+
+    cache_key = make_cache_key(input_text, PROMPT_VERSION)
+    cached = classification_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    return _classify_with_llm(input_text, cache_key)
+
+def _classify_with_llm(input_text: str, cache_key: str) -> dict:
+    # Callers have already tried the fast path and the cache
+    result = parse_response(generate(build_prompt(input_text)))
+    if not result.pop("parse_failed", False):
+        classification_cache.set(cache_key, result)
+    return result
+
+async def classify_input_async(input_text: str) -> dict:
+    fast_result = fast_classify(input_text)
+    if fast_result is not None:
+        return fast_result
+
+    cache_key = make_cache_key(input_text, PROMPT_VERSION)
+    return await _classify_flight.do(cache_key, lambda: _classify_uncached_async(input_text, cache_key))
+
+async def _classify_uncached_async(input_text: str, cache_key: str) -> dict:
+    cached = await run_blocking(classification_cache.get, cache_key)
+    if cached is not None:
+        return cached
+    return await _classify_with_llm_async(input_text, cache_key)
+
+async def _classify_with_llm_async(input_text: str, cache_key: str) -> dict:
+    result = parse_response(await generate_async(build_prompt(input_text)))
+    if not result.pop("parse_failed", False):
+        await run_blocking(classification_cache.set, cache_key, result)
+    return result
+
+def classify_batch(input_texts: list) -> list:
+    """Classify many inputs, packing fast-path and cache misses into shared LLM calls.
+
+    Items the batched response does not yield a result for are classified one
+    by one with the LLM; their fast-path and cache lookups were already done.
+    """
+    keys = [make_cache_key(text, PROMPT_VERSION) for text in input_texts]
+    results = _lookup_local(input_texts, keys)
+    misses = [i for i, result in enumerate(results) if result is None]
+
+    for chunk in _chunks(misses, CLASSIFIER_BATCH_SIZE):
+        raw = generate(build_batch_prompt([input_texts[i] for i in chunk]))
+        parsed = parse_batch_response(raw, len(chunk))
+        for position, i in enumerate(chunk):
+            if position in parsed:
+                results[i] = parsed[position]
+                classification_cache.set(keys[i], results[i])
+            else:
+                results[i] = _classify_with_llm(input_texts[i], keys[i])
+    return results
+
+async def classify_batch_async(input_texts: list) -> list:
+    keys = [make_cache_key(text, PROMPT_VERSION) for text in input_texts]
+    results = await run_blocking(_lookup_local, input_texts, keys)
+    misses = [i for i, result in enumerate(results) if result is None]
+
+    async def _classify_chunk(chunk):
+        raw = await generate_async(build_batch_prompt([input_texts[i] for i in chunk]))
+        parsed = parse_batch_response(raw, len(chunk))
+        fallbacks = []
+        for position, i in enumerate(chunk):
+            if position in parsed:
+                results[i] = parsed[position]
+                await run_blocking(classification_cache.set, keys[i], results[i])
+            else:
+                fallbacks.append(i)
+        if fallbacks:
+            print(f"[Gemini] Batch response missing {len(fallbacks)} of {len(chunk)} items, classifying individually")
+        retried = await asyncio.gather(*(
+            _classify_flight.do(keys[i], lambda i=i: _classify_with_llm_async(input_texts[i], keys[i])) for i in fallbacks
+        ))
+        for i, result in zip(fallbacks, retried):
+            results[i] = result
+
+    await asyncio.gather(*(_classify_chunk(chunk) for chunk in _chunks(misses, CLASSIFIER_BATCH_SIZE)))
+    return results
+
+def _lookup_local(input_texts: list, keys: list) -> list:
+    # Fast-path rules first, then the cache; None marks items that still need the LLM
+    results = [fast_classify(text) for text in input_texts]
+    return [result if result is not None else classification_cache.get(key) for result, key in zip(results, keys)]
+
+def _chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def get_classifier_stats() -> dict:
+    return {
+        "fast_path": get_fast_path_stats(),
+        "cache": classification_cache.stats(),
+        "single_flight": _classify_flight.stats(),
+    }
+
+CLASSIFIER_PROMPT = """
 You are an advanced AI classifier for a multi-agent system. Given any input (email text, JSON, or PDF content/filename), do the following:
 - Detect the format: one of ["email", "json", "pdf"]
 - Detect the business intent: one of ["RFQ", "Complaint", "Invoice", "Regulation", "Fraud Risk"]
@@ -24,74 +131,93 @@ Example 1:
 Input:
 From: John Doe <john@example.com>\nSubject: Urgent Complaint\nBody: I am very upset with your service. Please resolve this ASAP.
 Output:
-{{
-  "classification": {{
+{
+  "classification": {
     "format": "email",
     "intent": "Complaint",
     "tone": "angry"
-  }},
+  },
   "anomaly_flagged": false,
   "risk_triggered": false
-}}
+}
 
 Example 2:
 Input:
-{{"event_id": "123", "timestamp": "2024-06-01T12:00:00Z", "user_id": "u456", "amount": 15000}}
+{"event_id": "123", "timestamp": "2024-06-01T12:00:00Z", "user_id": "u456", "amount": 15000}
 Output:
-{{
-  "classification": {{
+{
+  "classification": {
     "format": "json",
     "intent": "Invoice",
     "tone": "neutral"
-  }},
+  },
   "anomaly_flagged": false,
   "risk_triggered": true
-}}
+}
 
 Example 3:
 Input:
 PDF file containing: Invoice Total: $12,000\nPolicy: GDPR
 Output:
-{{
-  "classification": {{
+{
+  "classification": {
     "format": "pdf",
     "intent": "Invoice",
     "tone": "neutral"
-  }},
+  },
   "anomaly_flagged": false,
   "risk_triggered": true
-}}
+}
 
-Now classify this input:
+"""
+
+def build_prompt(input_text: str) -> str:
+    return CLASSIFIER_PROMPT + f"""Now classify this input:
 {input_text}
 Return ONLY the JSON object as shown above.
 """
 
-    response = model.generate_content(prompt)
-    raw = response.text.strip()
+def build_batch_prompt(input_texts: list) -> str:
+    inputs = "\n\n".join(f"Input [{i}]:\n{text}" for i, text in enumerate(input_texts))
+    return CLASSIFIER_PROMPT + f"""Now classify each of the following {len(input_texts)} inputs independently:
 
-    # Attempt to extract clean JSON from Gemini's response
-    try:
-        # Remove Markdown formatting if it exists
-        if raw.startswith("```json"):
-            raw = raw.lstrip("```json").rstrip("```").strip()
-        elif raw.startswith("```"):
-            raw = raw.lstrip("```").rstrip("```").strip()
+{inputs}
 
-        parsed = json.loads(raw)
+Return ONLY a JSON array with one object per input, each shaped like the outputs above
+plus an "index" field holding the input number in brackets.
+"""
 
-        # Safely fill in defaults if fields are missing
-        classification = parsed.get("classification", {})
-        return {
-            "classification": {
-                "format": classification.get("format", "unknown") or "unknown",
-                "intent": classification.get("intent", "unknown") or "unknown",
-                "tone": classification.get("tone", "neutral") or "neutral",
-            },
-            "anomaly_flagged": parsed.get("anomaly_flagged", False),
-            "risk_triggered": parsed.get("risk_triggered", False),
-            "raw_response": raw  # optional for debugging/logging
-        }
+def strip_code_fences(raw: str) -> str:
+    # Remove Markdown formatting if it exists
+    if raw.startswith("```json"):
+        raw = raw.lstrip("```json").rstrip("```").strip()
+    elif raw.startswith("```"):
+        raw = raw.lstrip("```").rstrip("```").strip()
+    return raw
+
+def normalize_result(parsed: dict, raw: str) -> dict:
+    # Safely fill in defaults if fields are missing
+    classification = parsed.get("classification", {})
+    result = {
+        "classification": {
+            "format": classification.get("format", "unknown") or "unknown",
+            "intent": classification.get("intent", "unknown") or "unknown",
+            "tone": classification.get("tone", "neutral") or "neutral",
+        },
+        "anomaly_flagged": parsed.get("anomaly_flagged", False),
+        "risk_triggered": parsed.get("risk_triggered", False),
+        "raw_response": raw  # optional for debugging/logging
+    }
+    # Marks a tone the LLM did not actually return, so callers do not mistake the default for a verdict
+    if not classification.get("tone"):
+        result["tone_defaulted"] = True
+    return result
+
+def parse_response(raw: str) -> dict:
+    # Attempt to extract clean JSON from Gemini's response
+    try:
+        raw = strip_code_fences(raw)
+        return normalize_result(json.loads(raw), raw)
 
     except Exception as e:
         print(f"[Gemini] Failed to parse JSON: {e}")
@@ -103,5 +229,28 @@ Return ONLY the JSON object as shown above.
             },
             "anomaly_flagged": False,
             "risk_triggered": False,
-            "raw_response": raw
+            "raw_response": raw,
+            "tone_defaulted": True,
+            "parse_failed": True
         }
+
+def parse_batch_response(raw: str, count: int) -> dict:
+    """Map input index -> normalized result for every well-formed item in a batch response."""
+    try:
+        items = json.loads(strip_code_fences(raw))
+    except Exception as e:
+        print(f"[Gemini] Failed to parse batch JSON: {e}")
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    results = {}
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get("classification"), dict):
+            continue
+        index = item.get("index")
+        if isinstance(index, str) and index.strip("[] ").isdigit():
+            index = int(index.strip("[] "))
+        if isinstance(index, int) and 0 <= index < count and index not in results:
+            results[index] = normalize_result(item, json.dumps(item, ensure_ascii=False))
+    return results
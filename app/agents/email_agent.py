@@ -1,21 +1,11 @@
-import os
 import re
 import datetime
 import requests
-import google.generativeai as genai
-from dotenv import load_dotenv
-from utils.internal_actions import escalate_crm
-
-load_dotenv()
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-model = genai.GenerativeModel(model_name="models/gemini-2.0-flash")
+from agents.tone import tone_detector
+from router.rules import rule_constant
 
 CRM_ENDPOINT = "http://localhost:8000/crm/escalate"
 
-def call_gemini_chat(prompt: str) -> str:
-    response = model.generate_content(prompt)
-    return response.text.strip()
-
 def extract_sender(email_text: str) -> str:
     match = re.search(r"From:\s*(.+)", email_text)
     return match.group(1).strip() if match else "unknown"
@@ -36,30 +26,37 @@ def extract_issue(email_text: str) -> str:
     # Fallback: return the whole text
     return email_text.strip()
 
-def detect_tone(email_text: str) -> str:
-    prompt = f"""
-Detect the tone of this email. Choose one from:
-[polite, angry, escalated, neutral, threatening]
+def process_email(email_text: str, classifier_tone: str = None) -> dict:
+    """Process one email; classifier_tone is the classifier's tone for it, if already known."""
+    return build_email_result(email_text, *tone_detector.detect(email_text, classifier_tone, extract_issue(email_text)))
+
+async def process_email_async(email_text: str, classifier_tone: str = None) -> dict:
+    return build_email_result(
+        email_text, *await tone_detector.detect_async(email_text, classifier_tone, extract_issue(email_text))
+    )
 
-Email: "{email_text[:1000]}"
-Return ONLY one word.
-"""
-    tone = call_gemini_chat(prompt).lower()
-    return tone if tone in ["polite", "angry", "escalated", "neutral", "threatening"] else "neutral"
+async def process_emails_async(email_texts: list, classifier_tones: list = None) -> list:
+    """Process several emails, scoring their tones as one batch."""
+    tones = await tone_detector.detect_many_async(
+        email_texts, classifier_tones, [extract_issue(text) for text in email_texts]
+    )
+    return [build_email_result(text, tone, source) for text, (tone, source) in zip(email_texts, tones)]
 
-def process_email(email_text: str) -> dict:
+def build_email_result(email_text: str, tone: str, tone_source: str = None) -> dict:
     sender = extract_sender(email_text)
     urgency = extract_urgency(email_text)
     issue = extract_issue(email_text)
-    tone = detect_tone(email_text)
 
+    # The router executes proposed actions, once per item, together with its own
     action_taken = "logged"
-    if tone in ["angry", "escalated", "threatening"] and urgency == "high":
-        try:
-            escalate_crm({"sender": sender, "issue": issue})
-            action_taken = "escalated"
-        except Exception:
-            action_taken = "error"
+    proposed_actions = []
+    if tone in rule_constant("escalation_tones") and urgency == "high":
+        proposed_actions.append({
+            "action": "escalate",
+            "payload": {"sender": sender, "issue": issue},
+            "reason": f"{tone} tone with high urgency",
+        })
+        action_taken = "escalated"
 
     return {
         "agent": "email_agent",
@@ -68,5 +65,7 @@ def process_email(email_text: str) -> dict:
         "urgency": urgency,
         "issue": issue,
         "tone": tone,
-        "action": action_taken
+        "tone_source": tone_source,
+        "action": action_taken,
+        "proposed_actions": proposed_actions
     }
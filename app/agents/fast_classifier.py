@@ -0,0 +1,175 @@
+import os
+import re
+import json
+import threading
+from agents.email_agent import extract_urgency
+from agents.pdf_agent import extract_invoice_total, detect_compliance_keywords, PDF_TEXT_PREFIX
+from router.rules import rule_constant
+
+# Inputs scored at or above this confidence are classified without calling the LLM
+FAST_PATH_MIN_CONFIDENCE = float(os.getenv("FAST_PATH_MIN_CONFIDENCE", "0.8"))
+
+JSON_SIGNATURE_FIELDS = ["event_id", "timestamp", "user_id"]
+EMAIL_HEADERS = [r"^\s*From:", r"^\s*Subject:"]
+
+INTENT_KEYWORDS = {
+    "RFQ": ["rfq", "quotation", "quote", "pricing", "price list", "request for proposal"],
+    "Complaint": ["complaint", "upset", "disappointed", "unacceptable", "refund", "not working", "dissatisfied"],
+    "Invoice": ["invoice", "amount due", "payment due", "billing", "total due", "remittance"],
+    "Regulation": ["gdpr", "hipaa", "fda", "regulation", "regulatory", "compliance", "policy"],
+    "Fraud Risk": ["fraud", "suspicious", "phishing", "wire transfer", "verify your identity", "account suspended"],
+}
+TONE_KEYWORDS = {
+    "angry": ["upset", "angry", "furious", "unacceptable", "disappointed", "ridiculous"],
+    "threatening": ["legal action", "lawyer", "lawsuit", "or else", "sue", "report you"],
+    "escalated": ["escalate", "escalating", "your manager", "your supervisor", "final notice", "third time"],
+    "happy": ["great job", "appreciate", "pleased", "delighted", "love it"],
+}
+
+_lock = threading.Lock()
+_stats = {"evaluated": 0, "handled": 0}
+
+
+def _keyword_hits(text: str, keywords: dict) -> dict:
+    hits = {}
+    for label, words in keywords.items():
+        count = sum(1 for word in words if re.search(rf"\b{re.escape(word)}\b", text))
+        if count:
+            hits[label] = count
+    return hits
+
+
+def _pick_intent(text: str):
+    """Return (intent, confidence) from keyword hits in lowercased text."""
+    hits = _keyword_hits(text, INTENT_KEYWORDS)
+    if not hits:
+        return "unknown", 0.0
+    ranked = sorted(hits.items(), key=lambda item: item[1], reverse=True)
+    intent, count = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0
+    if count == runner_up:
+        return intent, 0.3
+    if count >= 2 and runner_up == 0:
+        return intent, 0.95
+    if runner_up == 0:
+        return intent, 0.85
+    return intent, 0.6
+
+
+def _pick_tone(text: str):
+    """Return (tone, confidence); None when no tone keyword matched (the input is not known to be neutral)."""
+    hits = _keyword_hits(text, TONE_KEYWORDS)
+    if not hits:
+        return None, 1.0
+    if len(hits) > 1:
+        return max(hits, key=hits.get), 0.7
+    return next(iter(hits)), 1.0
+
+
+def _max_amount(value) -> float:
+    """Largest numeric amount/total field anywhere in a JSON payload."""
+    if isinstance(value, dict):
+        amounts = [
+            float(v) for k, v in value.items()
+            if isinstance(v, (int, float)) and not isinstance(v, bool) and k.lower() in ("amount", "total")
+        ]
+        amounts += [_max_amount(v) for v in value.values() if isinstance(v, (dict, list))]
+        return max(amounts, default=0.0)
+    if isinstance(value, list):
+        return max((_max_amount(v) for v in value), default=0.0)
+    return 0.0
+
+
+def _score_json(payload: dict):
+    matched = [f for f in JSON_SIGNATURE_FIELDS if f in payload]
+    if not matched:
+        return None, 0.0
+    format_confidence = 1.0 if len(matched) == len(JSON_SIGNATURE_FIELDS) else 0.8
+    flat = json.dumps(payload, ensure_ascii=False).lower().replace("_", " ")
+    amount = _max_amount(payload)
+    intent, intent_confidence = _pick_intent(flat)
+    if intent == "unknown" and amount:
+        intent, intent_confidence = "Invoice", 0.85
+    return _result("json", intent, "neutral", risk=amount > rule_constant("invoice_risk_threshold")), format_confidence * intent_confidence
+
+
+def _score_email(text: str):
+    headers = sum(1 for pattern in EMAIL_HEADERS if re.search(pattern, text, re.MULTILINE | re.IGNORECASE))
+    if not headers:
+        return None, 0.0
+    format_confidence = 0.98 if headers == len(EMAIL_HEADERS) else 0.85
+    lowered = text.lower()
+    intent, intent_confidence = _pick_intent(lowered)
+    tone, tone_confidence = _pick_tone(lowered)
+    if tone == "angry" and extract_urgency(text) == "high" and intent == "Complaint":
+        tone = "escalated"
+    result = _result("email", intent, tone or "neutral", risk=intent == "Fraud Risk", tone_defaulted=tone is None)
+    return result, format_confidence * intent_confidence * tone_confidence
+
+
+def _score_pdf_text(text: str):
+    total = extract_invoice_total(text)
+    compliance = detect_compliance_keywords(text)
+    lowered = text.lower()
+    if total or "invoice" in lowered:
+        intent, intent_confidence = "Invoice", 0.9 if total else 0.8
+    elif compliance:
+        intent, intent_confidence = "Regulation", 0.85
+    else:
+        intent, intent_confidence = _pick_intent(lowered)
+    return _result("pdf", intent, "neutral", risk=total > rule_constant("invoice_risk_threshold") or bool(compliance)), intent_confidence
+
+
+def _result(fmt: str, intent: str, tone: str, risk: bool, tone_defaulted: bool = True) -> dict:
+    result = {
+        "classification": {"format": fmt, "intent": intent, "tone": tone},
+        "anomaly_flagged": False,
+        "risk_triggered": risk,
+    }
+    # The rules only read tone from email wording; anything else is a placeholder consumers must not trust
+    if tone_defaulted:
+        result["tone_defaulted"] = True
+    return result
+
+
+def score_input(input_data):
+    """Classify input with local rules, returning (result or None, confidence)."""
+    if isinstance(input_data, (bytes, bytearray)):
+        # Raw PDF bytes carry no readable text, so only the format is certain
+        if bytes(input_data[:5]) == b"%PDF-":
+            return _result("pdf", "unknown", "neutral", risk=False), 0.0
+        return None, 0.0
+    if isinstance(input_data, dict):
+        return _score_json(input_data)
+
+    text = str(input_data)
+    if text.startswith(PDF_TEXT_PREFIX):
+        return _score_pdf_text(text[len(PDF_TEXT_PREFIX):])
+    try:
+        parsed = json.loads(text)
+        if isinstance(parsed, dict):
+            return _score_json(parsed)
+    except ValueError:
+        pass
+    return _score_email(text)
+
+
+def fast_classify(input_data):
+    """Return a classifier result when local rules are confident enough, else None."""
+    result, confidence = score_input(input_data)
+    handled = result is not None and confidence >= FAST_PATH_MIN_CONFIDENCE
+    with _lock:
+        _stats["evaluated"] += 1
+        _stats["handled"] += handled
+    if not handled:
+        return None
+    result["raw_response"] = f"fast-path rules (confidence {confidence:.2f})"
+    return result
+
+
+def get_fast_path_stats() -> dict:
+    with _lock:
+        stats = dict(_stats)
+    stats["handled_ratio"] = round(stats["handled"] / stats["evaluated"], 4) if stats["evaluated"] else 0.0
+    stats["min_confidence"] = FAST_PATH_MIN_CONFIDENCE
+    return stats
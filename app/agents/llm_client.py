@@ -0,0 +1,51 @@
+import os
+import asyncio
+import google.generativeai as genai
+from dotenv import load_dotenv
+
+load_dotenv()
+genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+
+MODEL_NAME = "models/gemini-2.0-flash"
+# Concurrent Gemini calls allowed per process, and how many more may wait for a slot
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_MAX_PENDING = int(os.getenv("LLM_MAX_PENDING", "256"))
+
+model = genai.GenerativeModel(model_name=MODEL_NAME)
+
+_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+_pending = 0
+_rejected = 0
+
+
+class LLMOverloaded(Exception):
+    """Raised when too many LLM calls are already waiting for a slot."""
+
+
+def generate(prompt: str) -> str:
+    response = model.generate_content(prompt)
+    return response.text.strip()
+
+
+async def generate_async(prompt: str) -> str:
+    global _pending, _rejected
+    if _pending >= LLM_MAX_CONCURRENCY + LLM_MAX_PENDING:
+        _rejected += 1
+        raise LLMOverloaded("LLM backlog is full")
+    _pending += 1
+    try:
+        async with _semaphore:
+            response = await model.generate_content_async(prompt)
+            return response.text.strip()
+    finally:
+        _pending -= 1
+
+
+def get_llm_stats() -> dict:
+    return {
+        "max_concurrency": LLM_MAX_CONCURRENCY,
+        "max_pending": LLM_MAX_PENDING,
+        "in_flight": min(_pending, LLM_MAX_CONCURRENCY),
+        "waiting": max(_pending - LLM_MAX_CONCURRENCY, 0),
+        "rejected": _rejected,
+    }
@@ -1,55 +1,287 @@
 import fitz  # PyMuPDF
+import os
+import multiprocessing
 import datetime
 import re
 import requests
+import threading
 from io import BytesIO
-from utils.internal_actions import risk_alert
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from router.rules import rule_constant
 
 RISK_ALERT_ENDPOINT = "http://localhost:8000/risk_alert"
 COMPLIANCE_TERMS = ["GDPR", "FDA", "HIPAA"]
+TOTAL_PATTERN = re.compile(r'Total\s*[:\-]?\s*\$?([\d,]+\.\d{2})', re.IGNORECASE)
 
-def extract_text_from_pdf(file_bytes: bytes) -> str:
+# Marks classifier input as extracted PDF text (matches the classifier's few-shot example)
+PDF_TEXT_PREFIX = "PDF file containing:"
+# Approximate token budget for the excerpt sent to the classifier (~4 characters per token)
+PDF_EXCERPT_TOKENS = int(os.getenv("PDF_EXCERPT_TOKENS", "1500"))
+PDF_EXCERPT_LEAD_PAGES = int(os.getenv("PDF_EXCERPT_LEAD_PAGES", "2"))
+CHARS_PER_TOKEN = 4
+
+# Extraction limits: larger files are rejected, pages past PDF_MAX_PAGES are ignored
+PDF_MAX_BYTES = int(os.getenv("PDF_MAX_BYTES", str(50 * 1024 * 1024)))
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "1000"))
+# Documents with at least this many pages are extracted on a process pool
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "64"))
+PDF_PROCESS_WORKERS = int(os.getenv("PDF_PROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+# Stop reading once an invoice total and a compliance term have both been seen
+PDF_EARLY_STOP = os.getenv("PDF_EARLY_STOP", "1") == "1"
+
+# Scans of recently seen uploads, keyed by (sha256, filename)
+PDF_SCAN_CACHE_SIZE = int(os.getenv("PDF_SCAN_CACHE_SIZE", "128"))
+
+_process_pool = None
+_scan_cache = OrderedDict()
+_scan_cache_lock = threading.Lock()
+
+
+class PdfTooLarge(Exception):
+    """Raised when a PDF exceeds PDF_MAX_BYTES."""
+
+
+def _open_pdf(source):
+    # source is either the raw file bytes or a path on disk
+    if isinstance(source, (bytes, bytearray)):
+        return fitz.open(stream=BytesIO(source), filetype="pdf")
+    return fitz.open(source)
+
+def iter_pdf_pages(source, start: int = 0, stop: int = None):
+    """Yield page texts one at a time, opening the document lazily."""
+    doc = _open_pdf(source)
     try:
-        doc = fitz.open(stream=BytesIO(file_bytes), filetype="pdf")
-        text = "".join([page.get_text() for page in doc])
+        stop = doc.page_count if stop is None else min(stop, doc.page_count)
+        for number in range(start, stop):
+            yield doc.load_page(number).get_text()
+    finally:
         doc.close()
-        return text
+
+def _extract_page_range(source, start: int, stop: int) -> list:
+    # Runs in a worker process, so it must stay a picklable module-level function
+    return list(iter_pdf_pages(source, start, stop))
+
+def _get_process_pool():
+    global _process_pool
+    if _process_pool is None:
+        # Spawn fresh interpreters: forking a server that already runs threads (and grpc) can deadlock the child
+        _process_pool = ProcessPoolExecutor(
+            max_workers=PDF_PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_pool
+
+def shutdown_pdf_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+def iter_pdf_pages_parallel(source, page_count: int):
+    """Yield page texts in order, extracting ranges of pages on the process pool.
+
+    Ranges are submitted one wave (one range per worker) at a time so a consumer
+    that stops early leaves at most one wave of work behind, which is cancelled.
+    """
+    pool = _get_process_pool()
+    ranges = [(start, min(start + PDF_PAGES_PER_TASK, page_count))
+              for start in range(0, page_count, PDF_PAGES_PER_TASK)]
+    for offset in range(0, len(ranges), PDF_PROCESS_WORKERS):
+        futures = [pool.submit(_extract_page_range, source, start, stop)
+                   for start, stop in ranges[offset:offset + PDF_PROCESS_WORKERS]]
+        try:
+            for future in futures:
+                yield from future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+def stream_pdf_pages(source, page_count: int):
+    """Yield up to page_count page texts, in parallel for large documents."""
+    if page_count >= PDF_PARALLEL_MIN_PAGES and PDF_PROCESS_WORKERS > 1:
+        return iter_pdf_pages_parallel(source, page_count)
+    return iter_pdf_pages(source, 0, page_count)
+
+def _source_size(source) -> int:
+    if isinstance(source, (bytes, bytearray)):
+        return len(source)
+    return os.path.getsize(source)
+
+def scan_pdf(source, filename: str = "", early_stop: bool = PDF_EARLY_STOP) -> dict:
+    """Stream a PDF's pages once, keeping only what the agent and classifier need.
+
+    Returns the first invoice total, the compliance terms seen, the classifier
+    excerpt and extraction bookkeeping; the full text is never held in memory.
+    If extraction fails part way, the partial scan is returned with "error" set.
+    """
+    size = _source_size(source)
+    if size > PDF_MAX_BYTES:
+        raise PdfTooLarge(f"PDF is {size} bytes, limit is {PDF_MAX_BYTES}")
+
+    scan = {
+        "invoice_total": 0.0,
+        "compliance_mentions": [],
+        "excerpt": "",
+        "page_count": 0,
+        "pages_read": 0,
+        "stopped_early": False,
+        "truncated": False,
+    }
+    total_found = False
+    compliance = set()
+    lead, relevant = [], []
+    budget = PDF_EXCERPT_TOKENS * CHARS_PER_TOKEN
+    try:
+        doc = _open_pdf(source)
+        scan["page_count"] = doc.page_count
+        doc.close()
+        pages_to_read = min(scan["page_count"], PDF_MAX_PAGES)
+        scan["truncated"] = scan["page_count"] > pages_to_read
+
+        pages = stream_pdf_pages(source, pages_to_read)
+        for number, text in enumerate(pages, start=1):
+            scan["pages_read"] = number
+            if not total_found and TOTAL_PATTERN.search(text):
+                scan["invoice_total"] = extract_invoice_total(text)
+                total_found = True
+            compliance.update(detect_compliance_keywords(text))
+
+            section, is_lead = _excerpt_section(number, text)
+            target = lead if is_lead else relevant
+            if section and sum(map(len, target)) < budget:
+                target.append(section)
+
+            if early_stop and total_found and compliance and number < pages_to_read:
+                scan["stopped_early"] = True
+                pages.close()
+                break
+    except PdfTooLarge:
+        raise
+    except Exception as e:
+        print("Error extracting PDF:", e)
+        scan["error"] = str(e) or type(e).__name__
+
+    scan["compliance_mentions"] = [term for term in COMPLIANCE_TERMS if term in compliance]
+    scan["excerpt"] = _assemble_excerpt("".join(lead), "".join(relevant), filename, PDF_EXCERPT_TOKENS)
+    return scan
+
+def scan_pdf_file(path: str, filename: str, sha256: str) -> dict:
+    """scan_pdf for a spooled upload, reusing the scan of an identical earlier upload."""
+    key = (sha256, filename)
+    with _scan_cache_lock:
+        cached = _scan_cache.get(key)
+        if cached is not None:
+            _scan_cache.move_to_end(key)
+            return dict(cached, reused=True)
+
+    scan = scan_pdf(path, filename)
+    scan["sha256"] = sha256
+    # A failed extraction may be transient; never let later uploads of the file reuse it
+    if scan.get("error"):
+        return scan
+    with _scan_cache_lock:
+        _scan_cache[key] = scan
+        while len(_scan_cache) > PDF_SCAN_CACHE_SIZE:
+            _scan_cache.popitem(last=False)
+    return scan
+
+def extract_pages_from_pdf(file_bytes: bytes) -> list:
+    try:
+        return list(iter_pdf_pages(file_bytes, 0, PDF_MAX_PAGES))
     except Exception:
-        return ""
+        return []
+
+def extract_text_from_pdf(file_bytes: bytes) -> str:
+    return "".join(extract_pages_from_pdf(file_bytes))
 
 def extract_invoice_total(text: str) -> float:
-    match = re.search(r'Total\s*[:\-]?\s*\$?([\d,]+\.\d{2})', text, re.IGNORECASE)
+    match = TOTAL_PATTERN.search(text)
     return float(match.group(1).replace(",", "")) if match else 0.0
 
+def _is_relevant_line(line: str) -> bool:
+    return bool(TOTAL_PATTERN.search(line)) or bool(detect_compliance_keywords(line))
+
+def _excerpt_section(number: int, page: str):
+    """Return (section text, is_lead_page) for one page of the classifier excerpt."""
+    if number <= PDF_EXCERPT_LEAD_PAGES:
+        body = page.strip()
+    else:
+        body = "\n".join(line for line in page.splitlines() if _is_relevant_line(line)).strip()
+    section = f"[Page {number}]\n{body}\n" if body else ""
+    return section, number <= PDF_EXCERPT_LEAD_PAGES
+
+def _assemble_excerpt(lead: str, relevant: str, filename: str, token_budget: int) -> str:
+    # Lead pages may use at most half the budget while there are relevant lines to fit
+    budget = token_budget * CHARS_PER_TOKEN
+    header = f"{PDF_TEXT_PREFIX}\n"
+    if filename:
+        header += f"(filename: {filename})\n"
+
+    relevant = relevant[:budget - min(len(lead), budget // 2)]
+    lead = lead[:budget - len(relevant)]
+    if lead and not lead.endswith("\n"):
+        lead += "\n"
+    excerpt = lead + relevant
+    return header + (excerpt or "(no extractable text)\n")
+
+def build_pdf_excerpt(pages: list, filename: str = "", token_budget: int = PDF_EXCERPT_TOKENS) -> str:
+    """Build a bounded classifier input from extracted PDF pages.
+
+    The first PDF_EXCERPT_LEAD_PAGES pages are included as-is, followed by the
+    lines mentioning totals or compliance terms on later pages.
+    """
+    lead, relevant = "", ""
+    for number, page in enumerate(pages, start=1):
+        section, is_lead = _excerpt_section(number, page)
+        if is_lead:
+            lead += section
+        else:
+            relevant += section
+    return _assemble_excerpt(lead, relevant, filename, token_budget)
+
 def detect_compliance_keywords(text: str) -> list:
     return [term for term in COMPLIANCE_TERMS if term in text.upper()]
 
 def process_pdf(file_bytes: bytes) -> dict:
-    text = extract_text_from_pdf(file_bytes)
-    total = extract_invoice_total(text)
-    compliance_flags = detect_compliance_keywords(text)
+    return process_pdf_scan(scan_pdf(file_bytes))
 
-    triggered = total > 10000 or bool(compliance_flags)
+def process_pdf_scan(scan: dict) -> dict:
+    total = scan["invoice_total"]
+    compliance_flags = scan["compliance_mentions"]
+
+    threshold = rule_constant("invoice_risk_threshold")
+    triggered = total > threshold or bool(compliance_flags)
     trace = [f"Extracted total: {total}", f"Compliance mentions: {compliance_flags}"]
-    if total > 10000:
-        trace.append("Invoice total exceeds 10,000. Risk triggered.")
+    trace.append(f"Read {scan['pages_read']} of {scan['page_count']} pages.")
+    if scan.get("reused"):
+        trace.append("Reused extraction of an identical earlier upload.")
+    if scan["stopped_early"]:
+        trace.append("Stopped reading early: invoice total and compliance terms found.")
+    if scan["truncated"]:
+        trace.append(f"Pages beyond {PDF_MAX_PAGES} were not read.")
+    if scan.get("error"):
+        trace.append(f"Extraction failed after {scan['pages_read']} pages: {scan['error']}")
+    if total > threshold:
+        trace.append(f"Invoice total exceeds {threshold:,}. Risk triggered.")
     if compliance_flags:
         trace.append(f"Compliance terms found: {compliance_flags}. Risk triggered.")
+    proposed_actions = []
     if triggered:
-        try:
-            risk_alert({
-                "total": total,
-                "compliance_flags": compliance_flags
-            })
-            trace.append("Risk alert sent to endpoint.")
-        except Exception:
-            trace.append("Failed to send risk alert to endpoint.")
+        proposed_actions.append({
+            "action": "risk_alert",
+            "payload": {"total": total, "compliance_flags": compliance_flags},
+            "reason": f"invoice total over {threshold:,} or compliance terms found",
+        })
+        trace.append("Risk alert proposed.")
 
     return {
         "agent": "pdf_agent",
         "timestamp": datetime.datetime.utcnow().isoformat(),
+        "file_sha256": scan.get("sha256"),
         "invoice_total": total,
         "compliance_mentions": compliance_flags,
         "risk_triggered": triggered,
-        "decision_trace": trace
+        "decision_trace": trace,
+        "proposed_actions": proposed_actions
     }
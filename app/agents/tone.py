@@ -0,0 +1,242 @@
+# app/agents/tone.py
+
+import asyncio
+import math
+import os
+import re
+import threading
+from collections import Counter
+from agents.llm_client import generate, generate_async
+from memory.memory_store import decode_row
+
+TONES = ["polite", "angry", "escalated", "neutral", "threatening"]
+# Classifier tones that have a direct email-tone equivalent
+CLASSIFIER_TONE_MAP = {"happy": "polite"}
+
+# "auto": classifier tone, then the local model, then the LLM; "local": never call the LLM; "llm": always call it
+TONE_BACKEND = os.getenv("TONE_BACKEND", "auto").lower()
+# Labelled emails needed before the trained model is used, and the posterior it must reach to be trusted
+TONE_MODEL_MIN_SAMPLES = int(os.getenv("TONE_MODEL_MIN_SAMPLES", "50"))
+TONE_MODEL_MIN_CONFIDENCE = float(os.getenv("TONE_MODEL_MIN_CONFIDENCE", "0.8"))
+# Most recent memory entries read when training
+TONE_TRAINING_LIMIT = int(os.getenv("TONE_TRAINING_LIMIT", "20000"))
+# Tone sources whose labels are used for training (the model's own guesses are not)
+TRAINING_SOURCES = {"llm", "classifier"}
+
+TONE_LEXICON = {
+    "angry": ["upset", "angry", "furious", "outrageous", "unacceptable", "disappointed", "ridiculous", "terrible", "worst"],
+    "threatening": ["legal action", "lawyer", "lawsuit", "or else", "sue", "report you", "consequences"],
+    "escalated": ["escalate", "escalating", "your manager", "your supervisor", "final notice", "third time"],
+    "polite": ["please", "thank you", "thanks", "kindly", "appreciate", "grateful", "kind regards"],
+}
+_LEXICON_PATTERNS = {
+    tone: [re.compile(rf"\b{re.escape(word)}\b") for word in words] for tone, words in TONE_LEXICON.items()
+}
+TOKEN_PATTERN = re.compile(r"[a-z][a-z']+")
+
+
+def build_tone_prompt(email_text: str) -> str:
+    return f"""
+Detect the tone of this email. Choose one from:
+[polite, angry, escalated, neutral, threatening]
+
+Email: "{email_text[:1000]}"
+Return ONLY one word.
+"""
+
+
+def normalize_tone(tone) -> str:
+    """Map a tone label onto TONES, or None if it has no equivalent."""
+    if not isinstance(tone, str):
+        return None
+    tone = tone.strip().lower()
+    tone = CLASSIFIER_TONE_MAP.get(tone, tone)
+    return tone if tone in TONES else None
+
+
+def tone_from_classification(classification_result: dict):
+    """The classifier's tone for an item, or None when it is only a default (no tone keyword, unparsable reply)."""
+    if not classification_result or classification_result.get("tone_defaulted"):
+        return None
+    return normalize_tone(classification_result.get("classification", {}).get("tone"))
+
+
+def tokenize(text: str) -> list:
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    return tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+
+
+def lexicon_tone(text: str):
+    """Tone with the most lexicon hits, or None when there are none or the top two tie."""
+    lowered = text.lower()
+    hits = {tone: sum(1 for pattern in patterns if pattern.search(lowered)) for tone, patterns in _LEXICON_PATTERNS.items()}
+    ranked = sorted(((count, tone) for tone, count in hits.items() if count), reverse=True)
+    if not ranked or (len(ranked) > 1 and ranked[0][0] == ranked[1][0]):
+        return None
+    return ranked[0][1]
+
+
+class ToneModel:
+    """Multinomial naive Bayes over unigrams and bigrams, with Laplace smoothing."""
+
+    def __init__(self):
+        self.samples = 0
+        self.log_priors = {}
+        self.log_likelihoods = {}
+        self.unseen = {}
+
+    def train(self, samples: list):
+        """Fit on (text, tone) pairs; replaces anything learned before."""
+        doc_counts = Counter()
+        token_counts = {}
+        vocabulary = set()
+        for text, tone in samples:
+            tokens = tokenize(text)
+            doc_counts[tone] += 1
+            token_counts.setdefault(tone, Counter()).update(tokens)
+            vocabulary.update(tokens)
+        total = sum(doc_counts.values())
+        self.log_priors = {tone: math.log(count / total) for tone, count in doc_counts.items()}
+        self.log_likelihoods = {}
+        self.unseen = {}
+        for tone, counts in token_counts.items():
+            denominator = sum(counts.values()) + len(vocabulary)
+            self.log_likelihoods[tone] = {token: math.log((count + 1) / denominator) for token, count in counts.items()}
+            self.unseen[tone] = math.log(1 / denominator)
+        self.samples = total
+
+    @property
+    def ready(self) -> bool:
+        return self.samples >= TONE_MODEL_MIN_SAMPLES and len(self.log_priors) > 1
+
+    def predict_many(self, texts: list) -> list:
+        """(tone, posterior) for each text; the model is read once for the whole batch."""
+        log_priors, log_likelihoods, unseen = self.log_priors, self.log_likelihoods, self.unseen
+        results = []
+        for text in texts:
+            tokens = tokenize(text)
+            scores = {
+                tone: prior + sum(log_likelihoods[tone].get(token, unseen[tone]) for token in tokens)
+                for tone, prior in log_priors.items()
+            }
+            best = max(scores, key=scores.get)
+            normalizer = sum(math.exp(score - scores[best]) for score in scores.values())
+            results.append((best, 1 / normalizer))
+        return results
+
+
+class ToneDetector:
+    """Picks each email's tone from the cheapest source that can answer.
+
+    In order: the classifier's tone for the same item, the naive Bayes model
+    trained from the memory log (once it has enough samples and is confident),
+    the keyword lexicon, and finally one LLM call. Every result carries the
+    source it came from, which is stored with the email and keeps the model
+    from training on its own guesses.
+    """
+
+    def __init__(self, backend: str = TONE_BACKEND):
+        self.backend = backend
+        self.model = ToneModel()
+        self._lock = threading.Lock()
+        self._counters = Counter()
+
+    def train(self, samples: list) -> int:
+        model = ToneModel()
+        model.train(samples)
+        # Swap the fitted model in whole so concurrent scoring never sees a half-trained one
+        self.model = model
+        return model.samples
+
+    def train_from_store(self, store, source: str = "email_upload", limit: int = TONE_TRAINING_LIMIT) -> int:
+        """Train on the tones of recent stored emails that came from the classifier or the LLM."""
+        try:
+            with store.reader() as conn:
+                rows = conn.execute(
+                    "SELECT agent_data FROM memory WHERE source = ? ORDER BY id DESC LIMIT ?", (source, limit)
+                ).fetchall()
+            samples = []
+            for row in rows:
+                agent_data = decode_row(["agent_data"], row)["agent_data"]
+                if not isinstance(agent_data, dict):
+                    continue
+                tone = normalize_tone(agent_data.get("tone"))
+                # Entries from before tone_source was recorded were labelled by the LLM
+                if tone and agent_data.get("issue") and agent_data.get("tone_source", "llm") in TRAINING_SOURCES:
+                    samples.append((agent_data["issue"], tone))
+            return self.train(samples)
+        except Exception as e:
+            print("Error training tone model:", e)
+            return 0
+
+    def _local(self, texts: list, hints: list, bodies: list) -> list:
+        """(tone, source) per text, with None where only the LLM could decide.
+
+        The model scores bodies, the same issue text it was trained on.
+        """
+        results = [None] * len(texts)
+        pending = []
+        for i, hint in enumerate(hints):
+            tone = normalize_tone(hint)
+            if tone and self.backend != "llm":
+                results[i] = (tone, "classifier")
+            else:
+                pending.append(i)
+        if self.backend == "llm":
+            return results
+        model = self.model
+        if pending and model.ready:
+            predictions = model.predict_many([bodies[i] for i in pending])
+            undecided = []
+            for i, (tone, confidence) in zip(pending, predictions):
+                if confidence >= TONE_MODEL_MIN_CONFIDENCE:
+                    results[i] = (tone, "model")
+                else:
+                    undecided.append(i)
+            pending = undecided
+        for i in pending:
+            tone = lexicon_tone(texts[i])
+            if tone:
+                results[i] = (tone, "lexicon")
+            elif self.backend == "local":
+                results[i] = ("neutral", "default")
+        return results
+
+    def _count(self, results: list):
+        with self._lock:
+            self._counters.update(source for _, source in results)
+
+    def detect(self, email_text: str, hint: str = None, body: str = None) -> tuple:
+        result = self._local([email_text], [hint], [body or email_text])[0]
+        if result is None:
+            result = (normalize_tone(generate(build_tone_prompt(email_text))) or "neutral", "llm")
+        self._count([result])
+        return result
+
+    async def detect_async(self, email_text: str, hint: str = None, body: str = None) -> tuple:
+        return (await self.detect_many_async([email_text], [hint], [body or email_text]))[0]
+
+    async def detect_many_async(self, texts: list, hints: list = None, bodies: list = None) -> list:
+        """(tone, source) for each email; texts only the LLM can decide are sent to it concurrently."""
+        results = self._local(texts, hints or [None] * len(texts), bodies or texts)
+        fallback = [i for i, result in enumerate(results) if result is None]
+        if fallback:
+            replies = await asyncio.gather(*(generate_async(build_tone_prompt(texts[i])) for i in fallback))
+            for i, reply in zip(fallback, replies):
+                results[i] = (normalize_tone(reply) or "neutral", "llm")
+        self._count(results)
+        return results
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counters)
+        return {
+            "backend": self.backend,
+            "model_samples": self.model.samples,
+            "model_ready": self.model.ready,
+            "by_source": counts,
+            "llm_calls": counts.get("llm", 0),
+        }
+
+
+tone_detector = ToneDetector()
@@ -1,20 +1,54 @@
 from fastapi import FastAPI, UploadFile, File, Request
-from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+import os
 import json
+import zlib
+import asyncio
 from datetime import datetime
-import concurrent.futures
+from typing import Optional
+from contextlib import asynccontextmanager
 from jsonschema import validate, ValidationError
 
-from agents.classifier import classify_input
-from agents.email_agent import process_email
-from agents.json_agent import process_json
-from agents.pdf_agent import process_pdf
+from agents.classifier import classify_input_async, classify_batch_async, get_classifier_stats
+from agents.email_agent import (
+    process_email_async, process_emails_async, extract_sender, extract_urgency, extract_issue,
+)
+from agents.tone import tone_detector, tone_from_classification, lexicon_tone
+from agents.json_agent import process_json_async
+from agents.pdf_agent import scan_pdf_file, process_pdf_scan, shutdown_pdf_pool, PDF_MAX_BYTES, PDF_TEXT_PREFIX
+from agents.llm_client import get_llm_stats, LLMOverloaded
 from router.action_router import route_action
-from memory.memory_store import store_entry, get_all_entries
+from router.dispatcher import action_dispatcher
+from router.rules import rule_engine
+from memory.memory_store import (
+    query_entries, search_entries, get_memory_stats, find_near_duplicate, get_entry, memory_store,
+)
+from memory.near_duplicates import simhash, NEAR_DUP_ENABLED, NEAR_DUP_REUSE, NEAR_DUP_SUPPRESS_ACTIONS
+from memory.write_behind import memory_writer, enqueue_entry, MemoryQueueFull, MemoryWriteFailed, InvalidMemoryEntry
+from memory.retention import memory_retention
 from utils.internal_actions import escalate_crm, risk_alert, log_alert
+from utils.pipeline import run_stage, run_concurrently, StageError, CLASSIFIER_TIMEOUT, AGENT_TIMEOUT, BATCH_CLASSIFIER_TIMEOUT
+from utils.executors import run_blocking, get_pool_stats, shutdown_pools, PoolSaturated
+from utils.uploads import spool_upload, discard_upload, UploadTooLarge
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    memory_writer.start()
+    await asyncio.to_thread(tone_detector.train_from_store, memory_store)
+    memory_retention.start()
+    await action_dispatcher.start()
+    yield
+    # Flush queued memory entries (and their outbox actions) before the store and pools go away
+    await asyncio.to_thread(memory_writer.stop)
+    # Deliver due actions while the handlers and stub endpoints are still up; the rest wait in the outbox
+    await action_dispatcher.stop()
+    await asyncio.to_thread(memory_retention.stop)
+    shutdown_pools()
+    shutdown_pdf_pool()
+    memory_store.close()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,38 +57,156 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Requests allowed inside /process/* at once before new ones are shed with a 503
+MAX_INFLIGHT_REQUESTS = int(os.getenv("MAX_INFLIGHT_REQUESTS", "512"))
+inflight_requests = 0
+
+@app.middleware("http")
+async def limit_inflight_requests(request: Request, call_next):
+    global inflight_requests
+    if not request.url.path.startswith("/process/"):
+        return await call_next(request)
+    if inflight_requests >= MAX_INFLIGHT_REQUESTS:
+        return JSONResponse({"error": "Server busy, retry later."}, status_code=503)
+    inflight_requests += 1
+    try:
+        return await call_next(request)
+    finally:
+        inflight_requests -= 1
+
+@app.exception_handler(PoolSaturated)
+@app.exception_handler(LLMOverloaded)
+@app.exception_handler(MemoryQueueFull)
+@app.exception_handler(MemoryWriteFailed)
+async def overloaded_handler(request: Request, exc: Exception):
+    return JSONResponse({"error": str(exc)}, status_code=503)
+
+@app.exception_handler(InvalidMemoryEntry)
+async def invalid_entry_handler(request: Request, exc: InvalidMemoryEntry):
+    return JSONResponse({"error": str(exc)}, status_code=422)
+
 @app.exception_handler(Exception)
 async def generic_exception_handler(request: Request, exc: Exception):
     return PlainTextResponse(str(exc), status_code=500)
 
+def build_response(classification_result: dict, agent_data: dict, actions: dict) -> dict:
+    return {
+        "classification": classification_result.get("classification", {}),
+        "anomaly_flagged": classification_result.get("anomaly_flagged", False),
+        "risk_triggered": classification_result.get("risk_triggered", False),
+        "agent_data": agent_data,
+        "agent_trace": agent_data.get("decision_trace", []),
+        "action_router": actions,
+        "action_trace": actions.get("decision_trace", [])
+    }
+
+async def find_prior_copy(text: str, source: str):
+    """Fingerprint text and look for an earlier near-duplicate from the same source before the LLM stage.
+
+    Returns (fingerprint, match); match is {"memory_id", "distance"} plus the
+    prior "entry" when NEAR_DUP_REUSE is on, or None.
+    """
+    fingerprint = simhash(text) if NEAR_DUP_ENABLED else None
+    if fingerprint is None:
+        return None, None
+    match = await run_blocking(find_near_duplicate, fingerprint, source)
+    if match and NEAR_DUP_REUSE:
+        match["entry"] = await run_blocking(get_entry, match["memory_id"])
+    return fingerprint, match
+
+def same_email_decision(prior: dict, content: str) -> bool:
+    """Whether an email would be routed exactly like the prior one: same sender, urgency and tone cues."""
+    return (
+        prior.get("sender") == extract_sender(content)
+        and prior.get("urgency") == extract_urgency(content)
+        and lexicon_tone(prior.get("issue", "")) == lexicon_tone(extract_issue(content))
+    )
+
+def same_pdf_decision(prior: dict, scan: dict) -> bool:
+    """Whether a PDF scan would be routed exactly like the prior one: same file, or same total and compliance terms."""
+    if scan.get("error"):
+        return False
+    if scan.get("sha256") and prior.get("file_sha256") == scan["sha256"]:
+        return True
+    return (
+        prior.get("invoice_total") == scan["invoice_total"]
+        and sorted(prior.get("compliance_mentions", [])) == sorted(scan["compliance_mentions"])
+    )
+
+def reuse_prior_copy(match: dict, agent_data: dict = None):
+    """Results for a near-duplicate: the prior entry's classification, routed again unless suppression is on.
+
+    agent_data is the fresh agent output when the route already has it;
+    otherwise the prior entry's agent output is reused. Returns
+    (classification_result, agent_data, actions, outbox).
+    """
+    prior = match["entry"]
+    now = datetime.utcnow().isoformat()
+    note = f"Near-duplicate of entry {match['memory_id']} (distance {match['distance']})"
+    agent_data = agent_data or prior["agent_data"]
+    agent_data = {
+        **agent_data,
+        "timestamp": now,
+        "near_duplicate_of": match["memory_id"],
+        "decision_trace": agent_data.get("decision_trace", []) + [f"{note}; reused its results."],
+    }
+    outbox = []
+    if not NEAR_DUP_SUPPRESS_ACTIONS:
+        actions = route_action(agent_data, prior["classification"].get("classification", {}), outbox)
+        return prior["classification"], agent_data, actions, outbox
+    agent_data.pop("proposed_actions", None)
+    actions = {
+        "agent": "action_router",
+        "timestamp": now,
+        "actions_triggered": [],
+        "decision_trace": [f"{note}; actions suppressed."],
+    }
+    return prior["classification"], agent_data, actions, outbox
+
 @app.post("/process/email")
 async def process_email_route(request: Request):
     body = await request.json()
     source = "email_upload"
     content = body.get("content", "")
 
-    classification_result = classify_input(content)
-    classification = classification_result.get("classification", {})
-    anomaly_flagged = classification_result.get("anomaly_flagged", False)
-    risk_triggered = classification_result.get("risk_triggered", False)
-    raw_response = classification_result.get("raw_response", "")
+    fingerprint, duplicate = await find_prior_copy(content, source)
+    # Only reuse when nothing that drives routing differs; otherwise process normally and just record the link
+    if duplicate and duplicate.get("entry") and same_email_decision(duplicate["entry"]["agent_data"], content):
+        classification_result, agent_data, actions, outbox = reuse_prior_copy(duplicate)
+        await enqueue_entry(source, classification_result, agent_data, actions, fingerprint=fingerprint, outbox=outbox)
+        return build_response(classification_result, agent_data, actions)
 
-    agent_data = process_email(content)
-    actions = route_action(agent_data, classification)
-    store_entry(source, classification_result, agent_data, actions)
+    # Classify first so the email agent can reuse the classifier's tone instead of asking the LLM again
+    try:
+        classification_result = await run_stage("classifier", classify_input_async(content), timeout=CLASSIFIER_TIMEOUT)
+        agent_data = await run_stage(
+            "email_agent",
+            process_email_async(content, tone_from_classification(classification_result)),
+            timeout=AGENT_TIMEOUT,
+        )
+    except StageError as e:
+        print("Pipeline error:", e)
+        return {"error": str(e)}
 
-    return {
-        "classification": classification,
-        "anomaly_flagged": anomaly_flagged,
-        "risk_triggered": risk_triggered,
-        "agent_data": agent_data,
-        "agent_trace": agent_data.get("decision_trace", []),
-        "action_router": actions,
-        "action_trace": actions.get("decision_trace", [])
-    }
+    if duplicate:
+        agent_data["near_duplicate_of"] = duplicate["memory_id"]
+    outbox = []
+    actions = route_action(agent_data, classification_result.get("classification", {}), outbox)
+    await enqueue_entry(source, classification_result, agent_data, actions, fingerprint=fingerprint, outbox=outbox)
+
+    return build_response(classification_result, agent_data, actions)
 
 EXPECTED_FIELDS = ["event_id", "timestamp", "user_id"]
 
+def missing_fields_result(missing_fields: list) -> dict:
+    # JSON payloads without the expected fields skip the classifier entirely
+    return {
+        "classification": {"format": "json", "intent": "unknown", "tone": "neutral"},
+        "anomaly_flagged": True,
+        "risk_triggered": False,
+        "raw_response": f"Missing fields: {missing_fields}"
+    }
+
 @app.post("/process/json")
 async def process_json_route(request: Request):
     print("Received /process/json request")
@@ -69,105 +221,234 @@ async def process_json_route(request: Request):
     missing_fields = [f for f in EXPECTED_FIELDS if f not in content]
     print(f"Missing fields: {missing_fields}")
 
+    stages = {"agent": run_stage("json_agent", process_json_async(content), timeout=AGENT_TIMEOUT)}
     if not missing_fields:
-        def classify_with_timeout():
-            print("Calling classifier...")
-            return classify_input(json.dumps(content))
-        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-            future = executor.submit(classify_with_timeout)
-            try:
-                classification_result = future.result(timeout=10)
-                print("Classifier result:", classification_result)
-            except concurrent.futures.TimeoutError:
-                print("Classifier timed out")
-                return {"error": "Classifier timed out."}
-            except Exception as e:
-                print("Classifier error:", e)
-                return {"error": f"Classifier error: {str(e)}"}
-        classification = classification_result.get("classification", {})
-        anomaly_flagged = classification_result.get("anomaly_flagged", False)
-        risk_triggered = classification_result.get("risk_triggered", False)
-        raw_response = classification_result.get("raw_response", "")
+        stages["classifier"] = run_stage("classifier", classify_input_async(json.dumps(content)), timeout=CLASSIFIER_TIMEOUT)
+
+    try:
+        results = await run_concurrently(stages)
+    except StageError as e:
+        print("Pipeline error:", e)
+        return {"error": str(e)}
+
+    if missing_fields:
+        classification_result = missing_fields_result(missing_fields)
     else:
-        classification = {"format": "json", "intent": "unknown", "tone": "neutral"}
-        anomaly_flagged = True
-        risk_triggered = False
-        raw_response = f"Missing fields: {missing_fields}"
+        classification_result = results["classifier"]
+        print("Classifier result:", classification_result)
 
-    print("Running JSON agent...")
-    agent_data = process_json(content)
+    agent_data = results["agent"]
     print("Agent data:", agent_data)
 
     print("Routing actions...")
-    actions = route_action(agent_data, classification)
+    outbox = []
+    actions = route_action(agent_data, classification_result.get("classification", {}), outbox)
     print("Actions:", actions)
 
     print("Storing entry in memory...")
-    store_entry(source, {
-        "classification": classification,
-        "anomaly_flagged": anomaly_flagged,
-        "risk_triggered": risk_triggered,
-        "raw_response": raw_response
-    }, agent_data, actions)
+    await enqueue_entry(source, classification_result, agent_data, actions, outbox=outbox)
 
     print("Returning response")
-    return {
-        "classification": classification,
-        "anomaly_flagged": anomaly_flagged,
-        "risk_triggered": risk_triggered,
-        "agent_data": agent_data,
-        "agent_trace": agent_data.get("decision_trace", []),
-        "action_router": actions,
-        "action_trace": actions.get("decision_trace", [])
-    }
+    return build_response(classification_result, agent_data, actions)
 
 @app.post("/process/pdf")
 async def process_pdf_route(file: UploadFile = File(...)):
     source = "pdf_upload"
-    content = await file.read()
+    try:
+        spooled = await spool_upload(file, PDF_MAX_BYTES, suffix=".pdf")
+    except UploadTooLarge:
+        return JSONResponse({"error": f"PDF exceeds {PDF_MAX_BYTES} bytes."}, status_code=413)
 
-    classification_result = classify_input(content)
-    classification = classification_result.get("classification", {})
-    anomaly_flagged = classification_result.get("anomaly_flagged", False)
-    risk_triggered = classification_result.get("risk_triggered", False)
-    raw_response = classification_result.get("raw_response", "")
+    # Pages are streamed once from the spooled file; the classifier gets a bounded excerpt of them
+    try:
+        scan = await run_stage(
+            "pdf_agent",
+            run_blocking(scan_pdf_file, spooled["path"], file.filename or "", spooled["sha256"]),
+            timeout=AGENT_TIMEOUT,
+        )
+    except StageError as e:
+        print("Pipeline error:", e)
+        return {"error": str(e)}
+    finally:
+        discard_upload(spooled["path"])
 
-    agent_data = process_pdf(content)
-    actions = route_action(agent_data, classification)
-    store_entry(source, classification_result, agent_data, actions)
+    text = scan["excerpt"].removeprefix(PDF_TEXT_PREFIX)
+    search_text = f"{file.filename or ''}\n{text}"
+    fingerprint, duplicate = await find_prior_copy(text, source)
+    if duplicate and duplicate.get("entry") and same_pdf_decision(duplicate["entry"]["agent_data"], scan):
+        classification_result, agent_data, actions, outbox = reuse_prior_copy(duplicate, process_pdf_scan(scan))
+        await enqueue_entry(source, classification_result, agent_data, actions, search_text, fingerprint, outbox)
+        return build_response(classification_result, agent_data, actions)
 
-    return {
-        "classification": classification,
-        "anomaly_flagged": anomaly_flagged,
-        "risk_triggered": risk_triggered,
-        "agent_data": agent_data,
-        "agent_trace": agent_data.get("decision_trace", []),
-        "action_router": actions,
-        "action_trace": actions.get("decision_trace", [])
-    }
+    try:
+        classification_result = await run_stage(
+            "classifier", classify_input_async(scan["excerpt"]), timeout=CLASSIFIER_TIMEOUT
+        )
+    except StageError as e:
+        print("Pipeline error:", e)
+        return {"error": str(e)}
 
-@app.get("/memory")
-def get_memory():
-    raw_entries = get_all_entries()
-    
-    cleaned_entries = []
-    for entry in raw_entries:
-        cleaned_entry = list(entry)  # convert tuple to list if needed
-        try:
-            cleaned_entry[3] = json.loads(cleaned_entry[3])
-        except (json.JSONDecodeError, TypeError):
-            pass
+    agent_data = process_pdf_scan(scan)
+    if duplicate:
+        agent_data["near_duplicate_of"] = duplicate["memory_id"]
+    outbox = []
+    actions = route_action(agent_data, classification_result.get("classification", {}), outbox)
+    await enqueue_entry(source, classification_result, agent_data, actions, search_text, fingerprint, outbox)
+
+    return build_response(classification_result, agent_data, actions)
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+BATCH_SOURCES = {"email": "email_upload", "json": "json_webhook"}
+
+@app.post("/process/batch")
+async def process_batch_route(request: Request):
+    body = await request.json()
+    items = body.get("items") if isinstance(body, dict) else None
+    if not isinstance(items, list) or not items:
+        return {"error": "Body must be an object with a non-empty 'items' list."}
+    if len(items) > BATCH_MAX_ITEMS:
+        return JSONResponse({"error": f"Batch exceeds {BATCH_MAX_ITEMS} items."}, status_code=413)
+
+    errors = {}
+    missing = {}
+    classifier_inputs = {}
+    for i, item in enumerate(items):
+        item_type = item.get("type") if isinstance(item, dict) else None
+        content = item.get("content") if isinstance(item, dict) else None
+        if item_type == "email" and isinstance(content, str):
+            classifier_inputs[i] = content
+        elif item_type == "json" and isinstance(content, dict):
+            missing[i] = [f for f in EXPECTED_FIELDS if f not in content]
+            if not missing[i]:
+                classifier_inputs[i] = json.dumps(content)
+        else:
+            errors[i] = "Item needs type 'email' with string content or type 'json' with an object."
+
+    async def run_json_agent(i):
         try:
-            cleaned_entry[4] = json.loads(cleaned_entry[4])
-        except (json.JSONDecodeError, TypeError):
-            pass
+            return await run_stage("json_agent", process_json_async(items[i]["content"]), timeout=AGENT_TIMEOUT)
+        except StageError as e:
+            return {"error": str(e)}
+
+    async def classify_then_run_email_agents():
+        # Email agents wait for the classifier so they can reuse its tones; their tones are scored as one batch
+        classified = await run_stage(
+            "classifier", classify_batch_async(list(classifier_inputs.values())), timeout=BATCH_CLASSIFIER_TIMEOUT
+        )
+        classifications = dict(zip(classifier_inputs, classified))
         try:
-            cleaned_entry[5] = json.loads(cleaned_entry[5])
-        except (json.JSONDecodeError, TypeError):
-            pass
-        cleaned_entries.append(cleaned_entry)
-    
-    return JSONResponse(content=cleaned_entries)
+            email_results = await run_stage(
+                "email_agent",
+                process_emails_async(
+                    [items[i]["content"] for i in emails],
+                    [tone_from_classification(classifications.get(i)) for i in emails],
+                ),
+                timeout=AGENT_TIMEOUT,
+            )
+        except StageError as e:
+            email_results = [{"error": str(e)}] * len(emails)
+        return classifications, dict(zip(emails, email_results))
+
+    valid = [i for i in range(len(items)) if i not in errors]
+    emails = [i for i in valid if items[i]["type"] == "email"]
+    json_items = [i for i in valid if items[i]["type"] == "json"]
+    try:
+        results = await run_concurrently({
+            "classifier": classify_then_run_email_agents(),
+            "agents": asyncio.gather(*(run_json_agent(i) for i in json_items)),
+        })
+    except StageError as e:
+        print("Pipeline error:", e)
+        return {"error": str(e)}
+
+    classifications, agent_results = results["classifier"]
+    agent_results.update(zip(json_items, results["agents"]))
+
+    responses = []
+    for i, item in enumerate(items):
+        if i in errors or "error" in agent_results[i]:
+            responses.append({"index": i, "error": errors.get(i) or agent_results[i]["error"]})
+            continue
+        classification_result = classifications.get(i) or missing_fields_result(missing[i])
+        agent_data = agent_results[i]
+        outbox = []
+        actions = route_action(agent_data, classification_result.get("classification", {}), outbox)
+        await enqueue_entry(BATCH_SOURCES[item["type"]], classification_result, agent_data, actions, outbox=outbox)
+        responses.append({"index": i, **build_response(classification_result, agent_data, actions)})
+
+    return {"results": responses}
+
+@app.get("/memory")
+async def get_memory(
+    limit: int = 50,
+    cursor: Optional[int] = None,
+    source: Optional[str] = None,
+    format: Optional[str] = None,
+    intent: Optional[str] = None,
+    tone: Optional[str] = None,
+    risk: Optional[bool] = None,
+    anomaly: Optional[bool] = None,
+    action: Optional[str] = None,
+    min_invoice_total: Optional[float] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    page = await run_blocking(
+        query_entries,
+        limit=limit, cursor=cursor, since=since, until=until,
+        fields=fields.split(",") if fields else None,
+        source=source, format=format, intent=intent, tone=tone, risk=risk, anomaly=anomaly,
+        action=action, min_invoice_total=min_invoice_total,
+    )
+    return JSONResponse(content=page)
+
+@app.get("/memory/search")
+async def search_memory(q: str, limit: int = 20, offset: int = 0, source: Optional[str] = None,
+                        format: Optional[str] = None):
+    return await run_blocking(search_entries, q, limit=limit, offset=offset, source=source, format=format)
+
+@app.get("/memory/stats")
+async def memory_stats():
+    return await run_blocking(get_memory_stats)
+
+def export_lines(after_id: int, fields: Optional[list], compress: bool):
+    entries = memory_store.iter_entries(after_id=after_id, fields=fields)
+    lines = (json.dumps(entry, ensure_ascii=False).encode("utf-8") + b"\n" for entry in entries)
+    if not compress:
+        yield from lines
+        return
+    # wbits=31 produces a gzip stream
+    compressor = zlib.compressobj(wbits=31)
+    for line in lines:
+        chunk = compressor.compress(line)
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+@app.get("/memory/export")
+def export_memory(after_id: int = 0, fields: Optional[str] = None, gzip: bool = False):
+    filename = "memory-export.ndjson.gz" if gzip else "memory-export.ndjson"
+    return StreamingResponse(
+        export_lines(after_id, fields.split(",") if fields else None, gzip),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
+@app.get("/classifier/stats")
+def classifier_stats():
+    return {**get_classifier_stats(), "tone": tone_detector.stats(), "llm": get_llm_stats()}
+
+@app.get("/system/stats")
+def system_stats():
+    return {
+        "pools": get_pool_stats(),
+        "inflight_requests": inflight_requests,
+        "memory_writer": memory_writer.stats(),
+        "memory_retention": memory_retention.stats(),
+        "actions": action_dispatcher.stats(),
+        "action_rules": rule_engine.stats(),
+    }
 
 @app.post("/crm/escalate")
 def escalate_crm(payload: dict):
@@ -0,0 +1,171 @@
+# app/memory/classification_cache.py
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_DB_FILE = os.getenv("CLASSIFIER_CACHE_DB", "classifier_cache.db")
+CACHE_LRU_SIZE = int(os.getenv("CLASSIFIER_CACHE_LRU_SIZE", "1024"))
+CACHE_TTL_SECONDS = int(os.getenv("CLASSIFIER_CACHE_TTL", str(7 * 24 * 3600)))
+CACHE_MAX_ROWS = int(os.getenv("CLASSIFIER_CACHE_MAX_ROWS", "50000"))
+# How many writes between two eviction sweeps of the SQLite tier
+EVICTION_INTERVAL = 100
+
+
+def normalize_input(input_data) -> bytes:
+    """Return a canonical byte form of a classifier input.
+
+    JSON (dicts, lists or JSON text) is re-serialized with sorted keys, text has
+    its whitespace collapsed, raw bytes are used as-is.
+    """
+    if isinstance(input_data, (bytes, bytearray)):
+        return bytes(input_data)
+    if isinstance(input_data, (dict, list)):
+        return json.dumps(input_data, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    text = str(input_data)
+    try:
+        parsed = json.loads(text)
+        if isinstance(parsed, (dict, list)):
+            return normalize_input(parsed)
+    except ValueError:
+        pass
+    return re.sub(r"\s+", " ", text).strip().encode("utf-8")
+
+
+def make_cache_key(input_data, prompt_version: str) -> str:
+    """Content hash of the normalized input, scoped to a prompt version."""
+    digest = hashlib.sha256()
+    digest.update(prompt_version.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(normalize_input(input_data))
+    return digest.hexdigest()
+
+
+class ClassificationCache:
+    """Two-tier (in-process LRU + SQLite) cache of classifier results."""
+
+    def __init__(self, db_file: str = CACHE_DB_FILE, lru_size: int = CACHE_LRU_SIZE,
+                 ttl_seconds: int = CACHE_TTL_SECONDS, max_rows: int = CACHE_MAX_ROWS):
+        self.lru_size = lru_size
+        self.ttl_seconds = ttl_seconds
+        self.max_rows = max_rows
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_eviction = 0
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+        }
+        self._conn = None
+        if db_file:
+            self._conn = sqlite3.connect(db_file, timeout=10, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS classification_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT,
+                    created_at REAL,
+                    accessed_at REAL,
+                    expires_at REAL
+                )
+            ''')
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_cache_accessed ON classification_cache (accessed_at)"
+            )
+            self._conn.commit()
+
+    def _remember(self, key: str, value: dict, expires_at: float):
+        self._lru[key] = (value, expires_at)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def get(self, key: str):
+        """Return the cached result for key, or None."""
+        now = time.time()
+        with self._lock:
+            hit = self._lru.get(key)
+            if hit is not None:
+                value, expires_at = hit
+                if expires_at > now:
+                    self._lru.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return value
+                del self._lru[key]
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT value, expires_at FROM classification_cache WHERE key = ? AND expires_at > ?",
+                    (key, now)
+                ).fetchone()
+                if row is not None:
+                    value = json.loads(row[0])
+                    self._conn.execute(
+                        "UPDATE classification_cache SET accessed_at = ? WHERE key = ?", (now, key)
+                    )
+                    self._conn.commit()
+                    self._remember(key, value, row[1])
+                    self._counters["disk_hits"] += 1
+                    return value
+
+            self._counters["misses"] += 1
+            return None
+
+    def set(self, key: str, value: dict):
+        """Store a classifier result in both tiers."""
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        with self._lock:
+            self._remember(key, value, expires_at)
+            self._counters["stores"] += 1
+            if self._conn is None:
+                return
+            self._conn.execute('''
+                INSERT OR REPLACE INTO classification_cache (key, value, created_at, accessed_at, expires_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (key, json.dumps(value, ensure_ascii=False), now, now, expires_at))
+            self._conn.commit()
+            self._writes_since_eviction += 1
+            if self._writes_since_eviction >= EVICTION_INTERVAL:
+                self._writes_since_eviction = 0
+                self._evict(now)
+
+    def _evict(self, now: float):
+        """Drop expired rows, then the least recently used ones above max_rows."""
+        evicted = self._conn.execute(
+            "DELETE FROM classification_cache WHERE expires_at <= ?", (now,)
+        ).rowcount
+        count = self._conn.execute("SELECT COUNT(*) FROM classification_cache").fetchone()[0]
+        if count > self.max_rows:
+            evicted += self._conn.execute('''
+                DELETE FROM classification_cache WHERE key IN (
+                    SELECT key FROM classification_cache ORDER BY accessed_at LIMIT ?
+                )
+            ''', (count - self.max_rows,)).rowcount
+        self._conn.commit()
+        self._counters["evictions"] += evicted
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and the current tier sizes."""
+        with self._lock:
+            counters = dict(self._counters)
+            counters["memory_entries"] = len(self._lru)
+            if self._conn is not None:
+                counters["disk_entries"] = self._conn.execute(
+                    "SELECT COUNT(*) FROM classification_cache"
+                ).fetchone()[0]
+        lookups = counters["memory_hits"] + counters["disk_hits"] + counters["misses"]
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        counters["hit_ratio"] = round(hits / lookups, 4) if lookups else 0.0
+        return counters
+
+
+classification_cache = ClassificationCache()
@@ -0,0 +1,20 @@
+# app/memory/maintenance.py
+#
+# One-off maintenance for the memory database. Run from app/ while the API is stopped:
+#
+#     python -m memory.maintenance
+
+from memory.memory_store import memory_store
+
+
+def main():
+    if memory_store.incremental_vacuum_enabled():
+        print("Already using incremental auto_vacuum; nothing to do.")
+    else:
+        print(f"Converting {memory_store.db_file} to auto_vacuum=INCREMENTAL (full VACUUM, may take a while)...")
+        memory_store.enable_incremental_vacuum()
+        print("Done; retention runs will now return freed pages to the filesystem.")
+    memory_store.close()
+
+if __name__ == "__main__":
+    main()
@@ -3,57 +3,504 @@
 import sqlite3
 import json
 import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from collections import Counter
 from typing import Dict
+from memory.migrations import migrate
+from memory.codec import encode_document, decode_document, decode_text
+from memory.near_duplicates import (
+    INSERT_SIMHASH, DELETE_SIMHASH, SELECT_CANDIDATES, band_values, closest_match, window_start,
+)
+from memory.outbox import (
+    INSERT_OUTBOX, CLAIM_OUTBOX, MARK_DELIVERED, MARK_RETRY, MARK_FAILED, DELETE_OUTBOX, DELETE_DELIVERED_OUTBOX,
+    COUNT_OUTBOX, outbox_row,
+)
+from memory.search import (
+    INSERT_FTS, DELETE_FTS, SEARCH_SQL, SEARCH_COLUMNS, MEMORY_SEARCH_MAX_RESULTS, search_fields, build_match_query,
+)
+
+DB_FILE = os.getenv("MEMORY_DB_FILE", "memory.db")
+# Read connections kept open for concurrent queries; writes share one connection
+MEMORY_READ_CONNECTIONS = int(os.getenv("MEMORY_READ_CONNECTIONS", "4"))
+
+PRAGMAS = [
+    # Only takes effect on a new database; existing ones are converted with python -m memory.maintenance
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=10000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=134217728",
+]
+
+INSERT_ENTRY = '''
+    INSERT INTO memory (timestamp, source, classification, agent_data, actions,
+                        format, intent, tone, risk_triggered, anomaly_flagged, invoice_total, actions_triggered)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+INSERT_ACTION = 'INSERT OR IGNORE INTO memory_actions (action, memory_id) VALUES (?, ?)'
+SELECT_ALL = 'SELECT * FROM memory'
+UPSERT_STAT = '''
+    INSERT INTO memory_stats (dimension, key, count) VALUES (?, ?, ?)
+    ON CONFLICT (dimension, key) DO UPDATE SET count = count + excluded.count
+'''
+# Hourly buckets returned by get_stats, newest first
+MEMORY_STATS_HOURS = int(os.getenv("MEMORY_STATS_HOURS", "48"))
+
+MEMORY_COLUMNS = [
+    "id", "timestamp", "source", "classification", "agent_data", "actions",
+    "format", "intent", "tone", "risk_triggered", "anomaly_flagged", "invoice_total", "actions_triggered",
+]
+JSON_COLUMNS = ["classification", "agent_data", "actions", "actions_triggered"]
+BOOL_COLUMNS = ["risk_triggered", "anomaly_flagged"]
+# Columns returned when a query does not ask for specific fields
+DEFAULT_FIELDS = ["id", "timestamp", "source", "classification", "agent_data", "actions"]
+MEMORY_PAGE_MAX = int(os.getenv("MEMORY_PAGE_MAX", "500"))
+# Rows fetched per round trip when streaming an export
+MEMORY_EXPORT_CHUNK = int(os.getenv("MEMORY_EXPORT_CHUNK", "500"))
+
+# Filterable fields and the indexed SQL condition each one applies
+FILTER_CONDITIONS = {
+    "source": "source = ?",
+    "format": "format = ?",
+    "intent": "intent = ?",
+    "tone": "tone = ?",
+    "risk": "risk_triggered = ?",
+    "anomaly": "anomaly_flagged = ?",
+    "action": "id IN (SELECT memory_id FROM memory_actions WHERE action = ?)",
+    "min_invoice_total": "invoice_total >= ?",
+}
+
+
+class MemoryStore:
+    """SQLite memory log with a single writer connection and a pool of readers.
+
+    Connections stay open for the life of the store, so statements are prepared
+    once per connection and reused from sqlite3's statement cache.
+    """
+
+    def __init__(self, db_file: str = DB_FILE, read_connections: int = MEMORY_READ_CONNECTIONS):
+        self.db_file = db_file
+        self._write_lock = threading.Lock()
+        self._writer = self._connect()
+        self._init_schema()
+        self._readers = queue.Queue()
+        for _ in range(read_connections):
+            self._readers.put(self._connect())
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_file, timeout=10, check_same_thread=False, cached_statements=256)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _init_schema(self):
+        with self._write_lock:
+            migrate(self._writer)
+
+    @contextmanager
+    def writer(self):
+        """Yield the writer connection inside a transaction, serialized across threads."""
+        with self._write_lock:
+            with self._writer:
+                yield self._writer
+
+    @contextmanager
+    def reader(self):
+        """Borrow a read connection from the pool."""
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    @staticmethod
+    def _entry_row(entry: dict) -> tuple:
+        classification_result = entry["classification"]
+        classification = classification_result.get("classification", {})
+        agent_data = entry["agent_data"]
+        return (
+            agent_data.get("timestamp", ""),
+            entry["source"],
+            encode_document(classification_result),
+            encode_document(agent_data),
+            encode_document(entry["actions"]),
+            classification.get("format"),
+            classification.get("intent"),
+            classification.get("tone"),
+            int(bool(classification_result.get("risk_triggered"))),
+            int(bool(classification_result.get("anomaly_flagged"))),
+            agent_data.get("invoice_total"),
+            json.dumps(entry["actions"].get("actions_triggered", []), ensure_ascii=False),
+        )
+
+    def _insert_entries(self, conn: sqlite3.Connection, entries: list) -> list:
+        """Insert entries and their action rows on conn, returning the new ids in order.
+
+        AUTOINCREMENT ids are consecutive inside one write transaction, so the ids
+        of an executemany batch can be derived from the last one.
+        """
+        conn.executemany(INSERT_ENTRY, [self._entry_row(entry) for entry in entries])
+        last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        ids = list(range(last_id - len(entries) + 1, last_id + 1))
+        conn.executemany(INSERT_ACTION, [
+            (action, memory_id)
+            for memory_id, entry in zip(ids, entries)
+            for action in entry["actions"].get("actions_triggered", [])
+        ])
+        indexed = [
+            (memory_id, search_fields(entry["agent_data"], entry.get("search_text", "")))
+            for memory_id, entry in zip(ids, entries)
+        ]
+        conn.executemany(INSERT_FTS, [(memory_id, *fields) for memory_id, fields in indexed if fields])
+        conn.executemany(INSERT_OUTBOX, [
+            outbox_row(action, memory_id, encode_document)
+            for memory_id, entry in zip(ids, entries)
+            for action in entry.get("outbox", [])
+        ])
+        conn.executemany(INSERT_SIMHASH, [
+            (band, value, memory_id, entry["fingerprint"])
+            for memory_id, entry in zip(ids, entries) if entry.get("fingerprint") is not None
+            for band, value in band_values(entry["fingerprint"])
+        ])
+        conn.executemany(UPSERT_STAT, [
+            (dimension, key, count) for (dimension, key), count in self._stat_deltas(entries).items()
+        ])
+        return ids
+
+    @staticmethod
+    def _stat_deltas(entries: list) -> Counter:
+        """Count a batch of entries per (dimension, key), mirroring the memory_stats backfill."""
+        deltas = Counter()
+        for entry in entries:
+            classification_result = entry["classification"]
+            classification = classification_result.get("classification", {})
+            timestamp = entry["agent_data"].get("timestamp") or ""
+            deltas["total", ""] += 1
+            deltas["source", _stat_key(entry["source"])] += 1
+            deltas["intent", _stat_key(classification.get("intent"))] += 1
+            deltas["tone", _stat_key(classification.get("tone"))] += 1
+            deltas["risk", str(int(bool(classification_result.get("risk_triggered"))))] += 1
+            deltas["anomaly", str(int(bool(classification_result.get("anomaly_flagged"))))] += 1
+            deltas["hour", timestamp[:13]] += 1
+            for action in entry["actions"].get("actions_triggered", []):
+                deltas["action", action] += 1
+        return deltas
+
+    def store_entries(self, entries: list) -> list:
+        """Insert several entries in one transaction and return their ids.
+
+        Items without a "source" are standalone outbox actions (make_action_entry);
+        they are written in the same transaction but get no memory id.
+        """
+        records = [entry for entry in entries if "source" in entry]
+        standalone = [action for entry in entries if "source" not in entry for action in entry["outbox"]]
+        if not records and not standalone:
+            return []
+        with self.writer() as conn:
+            ids = self._insert_entries(conn, records) if records else []
+            conn.executemany(INSERT_OUTBOX, [outbox_row(action, None, encode_document) for action in standalone])
+            return ids
+
+    def store_entry(self, source: str, classification: dict, agent_data: dict, actions: dict):
+        self.store_entries([make_entry(source, classification, agent_data, actions)])
+
+    def delete_entries(self, ids: list) -> int:
+        """Delete entries and their action rows in one transaction; return how many were removed.
+
+        Outbox rows still pending or failed are kept, so deleting an entry never drops an undelivered action.
+        """
+        if not ids:
+            return 0
+        params = [(memory_id,) for memory_id in ids]
+        with self.writer() as conn:
+            conn.executemany("DELETE FROM memory_actions WHERE memory_id = ?", params)
+            conn.executemany(DELETE_FTS, params)
+            conn.executemany(DELETE_SIMHASH, params)
+            conn.executemany(DELETE_OUTBOX, params)
+            return conn.executemany("DELETE FROM memory WHERE id = ?", params).rowcount
+
+    def incremental_vacuum(self, pages: int) -> int:
+        """Release up to pages free pages to the filesystem and return how many were freed.
+
+        Databases created before auto_vacuum was enabled are left alone (0 is
+        returned) until they are converted with enable_incremental_vacuum.
+        """
+        with self._write_lock:
+            if self._writer.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                return 0
+            before = self._writer.execute("PRAGMA freelist_count").fetchone()[0]
+            # executescript steps the pragma to completion; execute() would free a single page
+            self._writer.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+            return before - self._writer.execute("PRAGMA freelist_count").fetchone()[0]
+
+    def incremental_vacuum_enabled(self) -> bool:
+        with self.reader() as conn:
+            return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+    def enable_incremental_vacuum(self) -> bool:
+        """Switch a legacy database to auto_vacuum=INCREMENTAL; returns False if it already was.
+
+        This rewrites the whole file with a full VACUUM, which blocks every
+        writer until it finishes, so run it as a maintenance step while the
+        app is stopped (python -m memory.maintenance).
+        """
+        with self._write_lock:
+            if self._writer.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                return False
+            self._writer.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self._writer.execute("VACUUM")
+            return True
+
+    def get_all_entries(self) -> list:
+        """Return every row as stored, with compact documents inflated back to JSON text."""
+        with self.reader() as conn:
+            rows = conn.execute(SELECT_ALL).fetchall()
+        return [tuple(decode_text(value) for value in row) for row in rows]
+
+    def query_entries(self, limit: int = 50, cursor: int = None, since: str = None, until: str = None,
+                      fields: list = None, **filters) -> dict:
+        """Return one page of entries, newest first, plus the cursor for the next page.
+
+        filters are keyed by FILTER_CONDITIONS names; None values are ignored.
+        since/until bound the entry timestamp (ISO strings, inclusive).
+        """
+        columns = [c for c in (fields or DEFAULT_FIELDS) if c in MEMORY_COLUMNS]
+        if "id" not in columns:
+            columns.insert(0, "id")
+        limit = max(1, min(limit, MEMORY_PAGE_MAX))
+
+        clauses, params = [], []
+        if cursor is not None:
+            clauses.append("id < ?")
+            params.append(cursor)
+        if since:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            clauses.append("timestamp <= ?")
+            params.append(until)
+        for name, value in filters.items():
+            if value is None or name not in FILTER_CONDITIONS:
+                continue
+            clauses.append(FILTER_CONDITIONS[name])
+            params.append(int(value) if isinstance(value, bool) else value)
+
+        sql = f"SELECT {', '.join(columns)} FROM memory"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(limit + 1)
+
+        with self.reader() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        entries = [decode_row(columns, row) for row in rows[:limit]]
+        next_cursor = entries[-1]["id"] if len(rows) > limit else None
+        return {"entries": entries, "next_cursor": next_cursor}
+
+    def claim_actions(self, limit: int, lease: float) -> list:
+        """Lease up to limit due outbox actions, oldest first, and return them decoded."""
+        now = time.time()
+        with self.writer() as conn:
+            rows = conn.execute(CLAIM_OUTBOX, (now + lease, now, limit)).fetchall()
+        return [
+            {"id": row_id, "idempotency_key": key, "action": action, "payload": decode_document(payload),
+             "attempts": attempts}
+            for row_id, key, action, payload, attempts in sorted(rows)
+        ]
+
+    def finish_actions(self, delivered: list = (), retries: list = (), failures: list = ()):
+        """Record a batch of delivery outcomes in one transaction.
+
+        delivered: outbox ids; retries: (next_attempt_at, refund_attempt, error, id);
+        failures: (error, id).
+        """
+        with self.writer() as conn:
+            conn.executemany(MARK_DELIVERED, [(row_id,) for row_id in delivered])
+            conn.executemany(MARK_RETRY, retries)
+            conn.executemany(MARK_FAILED, failures)
+
+    def purge_outbox(self, before: float) -> int:
+        """Delete delivered outbox rows created before the given epoch time; failed ones stay for inspection."""
+        with self.writer() as conn:
+            return conn.execute(DELETE_DELIVERED_OUTBOX, (before,)).rowcount
+
+    def outbox_stats(self) -> dict:
+        with self.reader() as conn:
+            rows = conn.execute(COUNT_OUTBOX).fetchall()
+        stats = {"pending": 0, "delivered": 0, "failed": 0, "oldest_pending_age": 0.0}
+        for status, count, oldest in rows:
+            stats[status] = count
+            if oldest is not None:
+                stats["oldest_pending_age"] = round(time.time() - oldest, 3)
+        return stats
+
+    def find_near_duplicate(self, fingerprint: int, source: str):
+        """Return {"memory_id", "distance"} of the closest recent entry from source with a similar fingerprint, or None.
+
+        Only entries inside NEAR_DUP_WINDOW_SECONDS are considered.
+        """
+        params = [source, window_start()] + [key for pair in band_values(fingerprint) for key in pair]
+        with self.reader() as conn:
+            candidates = conn.execute(SELECT_CANDIDATES, params).fetchall()
+        match = closest_match(fingerprint, candidates)
+        return {"memory_id": match[0], "distance": match[1]} if match else None
+
+    def get_entry(self, memory_id: int, fields: list = None):
+        """Return one decoded entry by id, or None."""
+        columns = [c for c in (fields or DEFAULT_FIELDS) if c in MEMORY_COLUMNS]
+        if "id" not in columns:
+            columns.insert(0, "id")
+        with self.reader() as conn:
+            row = conn.execute(f"SELECT {', '.join(columns)} FROM memory WHERE id = ?", (memory_id,)).fetchone()
+        return decode_row(columns, row) if row else None
+
+    def search(self, query: str, limit: int = 20, offset: int = 0, source: str = None, format: str = None) -> dict:
+        """Rank entries matching every term of query with BM25 and return hits with snippets."""
+        match = build_match_query(query)
+        if not match:
+            return {"query": query, "results": []}
+        filters, params = "", [match]
+        if source:
+            filters += " AND memory.source = ?"
+            params.append(source)
+        if format:
+            filters += " AND memory.format = ?"
+            params.append(format)
+        params += [max(1, min(limit, MEMORY_SEARCH_MAX_RESULTS)), max(0, offset)]
+        with self.reader() as conn:
+            rows = conn.execute(SEARCH_SQL.format(filters=filters), params).fetchall()
+        return {"query": query, "results": [dict(zip(SEARCH_COLUMNS, row)) for row in rows]}
+
+    def get_stats(self, hours: int = MEMORY_STATS_HOURS) -> dict:
+        """Return the pre-aggregated counters; cost depends on key cardinality, not history size."""
+        with self.reader() as conn:
+            rows = conn.execute("SELECT dimension, key, count FROM memory_stats WHERE dimension != 'hour'").fetchall()
+            hourly = conn.execute(
+                "SELECT key, count FROM memory_stats WHERE dimension = 'hour' ORDER BY key DESC LIMIT ?", (hours,)
+            ).fetchall()
+        stats = {"total": 0, "source": {}, "intent": {}, "tone": {}, "action": {}, "risk": {}, "anomaly": {}}
+        for dimension, key, count in rows:
+            if dimension == "total":
+                stats["total"] = count
+            elif dimension in ("risk", "anomaly"):
+                stats[dimension]["true" if key == "1" else "false"] = count
+            else:
+                stats.setdefault(dimension, {})[key] = count
+        stats["hourly"] = dict(reversed(hourly))
+        return stats
+
+    def iter_entries(self, after_id: int = 0, fields: list = None, chunk_size: int = MEMORY_EXPORT_CHUNK):
+        """Yield decoded entries with id > after_id in id order, chunk_size rows at a time.
+
+        Uses its own connection because a streaming response may resume the
+        generator on a different thread each time; memory stays O(chunk_size).
+        """
+        columns = [c for c in (fields or DEFAULT_FIELDS) if c in MEMORY_COLUMNS]
+        if "id" not in columns:
+            columns.insert(0, "id")
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                f"SELECT {', '.join(columns)} FROM memory WHERE id > ? ORDER BY id", (after_id,)
+            )
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield decode_row(columns, row)
+        finally:
+            conn.close()
+
+    def close(self):
+        with self._write_lock:
+            self._writer.close()
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+
+
+def make_entry(source: str, classification: dict, agent_data: dict, actions: dict,
+               search_text: str = "", fingerprint: int = None, outbox: list = None) -> Dict:
+    """Build a memory entry.
+
+    search_text is indexed for full-text search and fingerprint for near-duplicate
+    lookups; neither is stored with the entry itself. outbox holds actions
+    (memory.outbox.make_action) written to the action outbox in the same transaction.
+    """
+    entry = {"source": source, "classification": classification, "agent_data": agent_data, "actions": actions}
+    if search_text:
+        entry["search_text"] = search_text
+    if fingerprint is not None:
+        entry["fingerprint"] = fingerprint
+    if outbox:
+        entry["outbox"] = outbox
+    return entry
+
+
+def make_action_entry(action: dict) -> Dict:
+    """A write-behind item that only records an outbox action, for alerts raised outside a memory entry."""
+    return {"outbox": [action]}
+
+
+def _stat_key(value) -> str:
+    return "unknown" if value is None else str(value)
+
+
+def decode_row(columns: list, row: tuple) -> Dict:
+    """Turn a memory row into a dict, decoding the JSON columns where possible."""
+    entry = dict(zip(columns, row))
+    for column in JSON_COLUMNS:
+        if column in entry:
+            try:
+                entry[column] = decode_document(entry[column])
+            except (json.JSONDecodeError, TypeError, KeyError):
+                pass
+    for column in BOOL_COLUMNS:
+        if column in entry:
+            entry[column] = bool(entry[column])
+    return entry
+
+
+memory_store = MemoryStore()
 
-DB_FILE = "memory.db"
 
 def init_memory():
     """Initialize SQLite memory table if not exists."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS memory (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            source TEXT,
-            classification TEXT,
-            agent_data TEXT,
-            actions TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    memory_store._init_schema()
 
 def store_entry(source: str, classification: dict, agent_data: dict, actions: dict):
     """Insert a new memory log entry."""
     try:
-        conn = sqlite3.connect(DB_FILE, timeout=10)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO memory (timestamp, source, classification, agent_data, actions)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
-            agent_data.get("timestamp", ""),
-            source,
-            json.dumps(classification, ensure_ascii=False),
-            json.dumps(agent_data, ensure_ascii=False),
-            json.dumps(actions, ensure_ascii=False)
-        ))
-        conn.commit()
-        conn.close()
+        memory_store.store_entry(source, classification, agent_data, actions)
     except Exception as e:
         print("Error in store_entry:", e)
         raise
 
 def get_all_entries() -> list:
     """Return all stored memory log entries."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM memory')
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
-
-# Initialize DB if not already present
-if not os.path.exists(DB_FILE):
-    init_memory()
+    return memory_store.get_all_entries()
+
+def query_entries(**kwargs) -> dict:
+    """Return a filtered page of memory log entries."""
+    return memory_store.query_entries(**kwargs)
+
+def find_near_duplicate(fingerprint: int, source: str):
+    """Return the closest recent entry from the same source sharing a near-identical fingerprint, or None."""
+    return memory_store.find_near_duplicate(fingerprint, source)
+
+def get_entry(memory_id: int):
+    """Return one memory log entry by id."""
+    return memory_store.get_entry(memory_id)
+
+def search_entries(query: str, **kwargs) -> dict:
+    """Full-text search over email senders/issues and PDF text."""
+    return memory_store.search(query, **kwargs)
+
+def get_memory_stats() -> dict:
+    """Return counters per source, intent, tone, action, flag and hour."""
+    return memory_store.get_stats()
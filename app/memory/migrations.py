@@ -0,0 +1,162 @@
+# app/memory/migrations.py
+
+import sqlite3
+from memory.codec import decode_document
+from memory.search import CREATE_FTS, INSERT_FTS, search_fields
+from memory.near_duplicates import CREATE_SIMHASH, CREATE_SIMHASH_INDEX
+from memory.outbox import CREATE_OUTBOX, CREATE_OUTBOX_INDEXES
+
+# Columns promoted out of the JSON blobs in migration 2, with their backfill expressions
+HOT_COLUMNS = {
+    "format": ("TEXT", "json_extract(classification, '$.classification.format')"),
+    "intent": ("TEXT", "json_extract(classification, '$.classification.intent')"),
+    "tone": ("TEXT", "json_extract(classification, '$.classification.tone')"),
+    "risk_triggered": ("INTEGER NOT NULL DEFAULT 0", "COALESCE(json_extract(classification, '$.risk_triggered'), 0)"),
+    "anomaly_flagged": ("INTEGER NOT NULL DEFAULT 0", "COALESCE(json_extract(classification, '$.anomaly_flagged'), 0)"),
+    "invoice_total": ("REAL", "json_extract(agent_data, '$.invoice_total')"),
+    "actions_triggered": ("TEXT", "json_extract(actions, '$.actions_triggered')"),
+}
+
+
+def _create_memory_table(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS memory (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT,
+            source TEXT,
+            classification TEXT,
+            agent_data TEXT,
+            actions TEXT
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_memory_timestamp ON memory (timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_memory_source ON memory (source, id)")
+
+
+def _promote_hot_fields(conn: sqlite3.Connection):
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(memory)")}
+    for column, (column_type, _) in HOT_COLUMNS.items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE memory ADD COLUMN {column} {column_type}")
+    conn.execute("UPDATE memory SET " + ", ".join(
+        f"{column} = {expression}" for column, (_, expression) in HOT_COLUMNS.items()
+    ))
+
+    # One row per triggered action, so "entries that escalated" is an index lookup
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS memory_actions (
+            action TEXT NOT NULL,
+            memory_id INTEGER NOT NULL,
+            PRIMARY KEY (action, memory_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        INSERT OR IGNORE INTO memory_actions (action, memory_id)
+        SELECT value, memory.id FROM memory, json_each(memory.actions, '$.actions_triggered')
+    ''')
+
+    # The JSON expression indexes are superseded by indexes on the real columns
+    for name in ("intent", "tone", "risk", "anomaly"):
+        conn.execute(f"DROP INDEX IF EXISTS idx_memory_{name}")
+    for column in ("format", "intent", "tone", "risk_triggered", "anomaly_flagged"):
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_memory_{column} ON memory ({column}, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_memory_invoice_total ON memory (invoice_total)")
+
+
+# Dimensions kept in memory_stats and the SQL expression each one counts by
+STATS_DIMENSIONS = {
+    "total": "''",
+    "source": "source",
+    "intent": "intent",
+    "tone": "tone",
+    "risk": "risk_triggered",
+    "anomaly": "anomaly_flagged",
+    "hour": "substr(timestamp, 1, 13)",
+}
+
+
+def _create_memory_stats(conn: sqlite3.Connection):
+    # Counters maintained at insert time so dashboards never scan the log
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS memory_stats (
+            dimension TEXT NOT NULL,
+            key TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (dimension, key)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("DELETE FROM memory_stats")
+    for dimension, expression in STATS_DIMENSIONS.items():
+        conn.execute(f'''
+            INSERT INTO memory_stats (dimension, key, count)
+            SELECT ?, COALESCE(CAST({expression} AS TEXT), 'unknown'), COUNT(*) FROM memory GROUP BY 2
+        ''', (dimension,))
+    conn.execute('''
+        INSERT INTO memory_stats (dimension, key, count)
+        SELECT 'action', action, COUNT(*) FROM memory_actions GROUP BY action
+    ''')
+
+
+def _create_memory_fts(conn: sqlite3.Connection):
+    conn.execute(CREATE_FTS)
+    conn.execute("DELETE FROM memory_fts")
+    # Documents may be compact BLOBs, so the backfill decodes them in Python.
+    # Earlier PDF entries did not keep their text and are not searchable.
+    cursor = conn.execute("SELECT id, agent_data FROM memory WHERE source = 'email_upload' OR format = 'email'")
+    while True:
+        rows = cursor.fetchmany(1000)
+        if not rows:
+            break
+        params = []
+        for memory_id, agent_data in rows:
+            try:
+                fields = search_fields(decode_document(agent_data))
+            except (ValueError, TypeError, KeyError):
+                continue
+            if fields:
+                params.append((memory_id, *fields))
+        conn.executemany(INSERT_FTS, params)
+
+
+def _create_simhash_index(conn: sqlite3.Connection):
+    # Only new entries are fingerprinted; earlier ones did not keep their full text
+    conn.execute(CREATE_SIMHASH)
+    conn.execute(CREATE_SIMHASH_INDEX)
+
+
+def _create_action_outbox(conn: sqlite3.Connection):
+    conn.execute(CREATE_OUTBOX)
+    for statement in CREATE_OUTBOX_INDEXES:
+        conn.execute(statement)
+
+
+# (version, description, apply) in order; never edit an entry once released, add a new one
+MIGRATIONS = [
+    (1, "create memory table", _create_memory_table),
+    (2, "promote hot fields to indexed columns", _promote_hot_fields),
+    (3, "add incrementally maintained memory stats", _create_memory_stats),
+    (4, "add full-text search index", _create_memory_fts),
+    (5, "add near-duplicate fingerprint index", _create_simhash_index),
+    (6, "add action outbox", _create_action_outbox),
+]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Apply pending migrations, each in its own transaction, and return the schema version.
+
+    The version lives in PRAGMA user_version and is re-read under BEGIN IMMEDIATE,
+    so several processes starting at once apply each migration exactly once.
+    """
+    for version, description, apply in MIGRATIONS:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version > current:
+                apply(conn)
+                conn.execute(f"PRAGMA user_version = {version}")
+                print(f"Applied memory migration {version}: {description}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return conn.execute("PRAGMA user_version").fetchone()[0]
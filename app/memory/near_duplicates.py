@@ -0,0 +1,96 @@
+# app/memory/near_duplicates.py
+
+import datetime
+import hashlib
+import os
+import re
+
+NEAR_DUP_ENABLED = os.getenv("NEAR_DUP_ENABLED", "true").lower() == "true"
+FINGERPRINT_BITS = 64
+# Fingerprints are indexed in this many bands; by pigeonhole, two within
+# NEAR_DUP_BANDS - 1 bits of each other share at least one band exactly
+NEAR_DUP_BANDS = 6
+# Fingerprints at most this many bits apart are near-duplicates (capped at NEAR_DUP_BANDS - 1)
+NEAR_DUP_MAX_DISTANCE = min(int(os.getenv("NEAR_DUP_MAX_DISTANCE", "4")), NEAR_DUP_BANDS - 1)
+# Only entries at most this many seconds old are matched (0: no limit), so a resend
+# of an issue that is still open after the window is treated as new
+NEAR_DUP_WINDOW_SECONDS = float(os.getenv("NEAR_DUP_WINDOW_SECONDS", "86400"))
+# Reuse the prior entry's classification and agent output instead of processing the copy again
+NEAR_DUP_REUSE = os.getenv("NEAR_DUP_REUSE", "true").lower() == "true"
+# Skip action routing for reused copies; by default their actions are routed again
+NEAR_DUP_SUPPRESS_ACTIONS = os.getenv("NEAR_DUP_SUPPRESS_ACTIONS", "false").lower() == "true"
+# Texts with fewer tokens than this are too short to fingerprint reliably
+NEAR_DUP_MIN_TOKENS = int(os.getenv("NEAR_DUP_MIN_TOKENS", "8"))
+# (bit offset, width) of each band; together they cover all 64 bits
+BANDS = [(0, 11), (11, 11), (22, 11), (33, 11), (44, 10), (54, 10)]
+
+CREATE_SIMHASH = '''
+    CREATE TABLE IF NOT EXISTS memory_simhash (
+        band INTEGER NOT NULL,
+        value INTEGER NOT NULL,
+        memory_id INTEGER NOT NULL,
+        fingerprint INTEGER NOT NULL,
+        PRIMARY KEY (band, value, memory_id)
+    ) WITHOUT ROWID
+'''
+CREATE_SIMHASH_INDEX = "CREATE INDEX IF NOT EXISTS idx_memory_simhash_memory_id ON memory_simhash (memory_id)"
+INSERT_SIMHASH = 'INSERT OR IGNORE INTO memory_simhash (band, value, memory_id, fingerprint) VALUES (?, ?, ?, ?)'
+DELETE_SIMHASH = 'DELETE FROM memory_simhash WHERE memory_id = ?'
+# Candidates are limited to entries from the same source, so an email never matches a PDF,
+# and to those written since a cutoff timestamp
+SELECT_CANDIDATES = '''
+    SELECT DISTINCT memory_simhash.memory_id, memory_simhash.fingerprint
+    FROM memory_simhash JOIN memory ON memory.id = memory_simhash.memory_id
+    WHERE memory.source = ? AND memory.timestamp >= ? AND (''' + " OR ".join(["(band = ? AND value = ?)"] * NEAR_DUP_BANDS) + ")"
+
+
+def _tokens(text: str) -> list:
+    return re.findall(r"\w+", text.lower())
+
+
+def simhash(text: str):
+    """64-bit SimHash of term frequencies, as a signed integer for SQLite; None if text is too short.
+
+    Single words are used rather than shingles: on email-sized texts a reply
+    prefix or reworded phrase changes too many shingles to stay within a few bits.
+    """
+    tokens = _tokens(text)
+    if len(tokens) < NEAR_DUP_MIN_TOKENS:
+        return None
+    weights = [0] * FINGERPRINT_BITS
+    counts = {}
+    for token in tokens:
+        counts[token] = counts.get(token, 0) + 1
+    for token, count in counts.items():
+        value = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += count if value >> bit & 1 else -count
+    fingerprint = sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+    return fingerprint - (1 << FINGERPRINT_BITS) if fingerprint >= 1 << (FINGERPRINT_BITS - 1) else fingerprint
+
+
+def window_start(window: float = NEAR_DUP_WINDOW_SECONDS) -> str:
+    """ISO timestamp of the oldest entry a match may come from; "" when the window is unlimited."""
+    if window <= 0:
+        return ""
+    return (datetime.datetime.utcnow() - datetime.timedelta(seconds=window)).isoformat()
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin((a ^ b) & ((1 << FINGERPRINT_BITS) - 1)).count("1")
+
+
+def band_values(fingerprint: int) -> list:
+    """(band, value) keys under which a fingerprint is indexed."""
+    unsigned = fingerprint & ((1 << FINGERPRINT_BITS) - 1)
+    return [(band, unsigned >> offset & ((1 << width) - 1)) for band, (offset, width) in enumerate(BANDS)]
+
+
+def closest_match(fingerprint: int, candidates: list, max_distance: int = NEAR_DUP_MAX_DISTANCE):
+    """Pick the nearest (then newest) candidate within max_distance; returns (memory_id, distance) or None."""
+    best = None
+    for memory_id, candidate in candidates:
+        distance = hamming_distance(fingerprint, candidate)
+        if distance <= max_distance and (best is None or (distance, -memory_id) < (best[1], -best[0])):
+            best = (memory_id, distance)
+    return best
@@ -0,0 +1,58 @@
+# app/memory/outbox.py
+
+import time
+import uuid
+
+CREATE_OUTBOX = '''
+    CREATE TABLE IF NOT EXISTS action_outbox (
+        id INTEGER PRIMARY KEY,
+        idempotency_key TEXT NOT NULL UNIQUE,
+        action TEXT NOT NULL,
+        payload,
+        memory_id INTEGER,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        created_at REAL NOT NULL,
+        last_error TEXT
+    )
+'''
+CREATE_OUTBOX_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_outbox_due ON action_outbox (status, next_attempt_at)",
+    "CREATE INDEX IF NOT EXISTS idx_outbox_memory_id ON action_outbox (memory_id)",
+]
+INSERT_OUTBOX = '''
+    INSERT OR IGNORE INTO action_outbox (idempotency_key, action, payload, memory_id, next_attempt_at, created_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+# Claiming pushes next_attempt_at out by the lease, so a row whose sender
+# crashed becomes due again once the lease expires (at-least-once delivery)
+CLAIM_OUTBOX = '''
+    UPDATE action_outbox SET attempts = attempts + 1, next_attempt_at = ?
+    WHERE id IN (
+        SELECT id FROM action_outbox WHERE status = 'pending' AND next_attempt_at <= ?
+        ORDER BY next_attempt_at, id LIMIT ?
+    )
+    RETURNING id, idempotency_key, action, payload, attempts
+'''
+MARK_DELIVERED = "UPDATE action_outbox SET status = 'delivered', last_error = NULL WHERE id = ?"
+MARK_RETRY = "UPDATE action_outbox SET next_attempt_at = ?, attempts = attempts - ?, last_error = ? WHERE id = ?"
+MARK_FAILED = "UPDATE action_outbox SET status = 'failed', last_error = ? WHERE id = ?"
+# Only delivered rows go with their entry; pending and failed actions outlive it
+DELETE_OUTBOX = "DELETE FROM action_outbox WHERE memory_id = ? AND status = 'delivered'"
+DELETE_DELIVERED_OUTBOX = "DELETE FROM action_outbox WHERE status = 'delivered' AND created_at < ?"
+COUNT_OUTBOX = '''
+    SELECT status, COUNT(*), MIN(CASE WHEN status = 'pending' THEN created_at END)
+    FROM action_outbox GROUP BY status
+'''
+
+
+def make_action(action: str, payload: dict, idempotency_key: str = None) -> dict:
+    """An action to record in the outbox; the key is fixed now so retried writes stay idempotent."""
+    return {"action": action, "payload": payload, "idempotency_key": idempotency_key or uuid.uuid4().hex}
+
+
+def outbox_row(action: dict, memory_id=None, encode=None) -> tuple:
+    now = time.time()
+    payload = encode(action["payload"]) if encode else action["payload"]
+    return (action["idempotency_key"], action["action"], payload, memory_id, now, now)
@@ -0,0 +1,163 @@
+# app/memory/retention.py
+
+import datetime
+import gzip
+import json
+import os
+import threading
+from memory.memory_store import memory_store, decode_row, MEMORY_COLUMNS
+
+# Entries older than this many days are archived and removed from the live table (0, the default, keeps everything)
+MEMORY_RETENTION_DAYS = int(os.getenv("MEMORY_RETENTION_DAYS", "0"))
+# Archived entries are appended to one gzipped NDJSON file per month in this directory
+MEMORY_ARCHIVE_DIR = os.getenv("MEMORY_ARCHIVE_DIR", "memory_archive")
+# Delete archived archive files older than this many days (0 keeps them forever)
+MEMORY_ARCHIVE_RETENTION_DAYS = int(os.getenv("MEMORY_ARCHIVE_RETENTION_DAYS", "0"))
+# Seconds between retention runs, and rows moved per transaction
+MEMORY_RETENTION_INTERVAL = float(os.getenv("MEMORY_RETENTION_INTERVAL", "3600"))
+MEMORY_RETENTION_BATCH = int(os.getenv("MEMORY_RETENTION_BATCH", "1000"))
+# Free pages returned to the OS per run once rows have been deleted
+MEMORY_VACUUM_PAGES = int(os.getenv("MEMORY_VACUUM_PAGES", "2000"))
+
+
+def partition_name(timestamp: str) -> str:
+    """Monthly partition an entry belongs to, e.g. 2026-10."""
+    return timestamp[:7] if timestamp and len(timestamp) >= 7 else "undated"
+
+
+def archive_path(partition: str, archive_dir: str = MEMORY_ARCHIVE_DIR) -> str:
+    return os.path.join(archive_dir, f"memory-{partition}.ndjson.gz")
+
+
+class RetentionManager:
+    """Moves expired memory entries into monthly gzip archives and compacts the database.
+
+    The live table holds the retention window only, so queries never touch
+    archived months. Each run archives in id order, fsyncs the archive, then
+    deletes the archived rows; a crash in between can only duplicate lines in
+    an archive, never lose an entry.
+    """
+
+    def __init__(self, store, retention_days: int = MEMORY_RETENTION_DAYS, archive_dir: str = MEMORY_ARCHIVE_DIR,
+                 interval: float = MEMORY_RETENTION_INTERVAL, batch_size: int = MEMORY_RETENTION_BATCH):
+        self.store = store
+        self.retention_days = retention_days
+        self.archive_dir = archive_dir
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stopping = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._last_run = {}
+
+    def start(self):
+        if self.retention_days <= 0:
+            return
+        if not self.store.incremental_vacuum_enabled():
+            print("Memory retention: database predates auto_vacuum; run python -m memory.maintenance "
+                  "while the app is stopped to reclaim space from archived entries")
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="memory-retention", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 30):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print("Error in memory retention run:", e)
+            self._stopping.wait(self.interval)
+
+    def cutoff(self, now: datetime.datetime = None) -> str:
+        now = now or datetime.datetime.utcnow()
+        return (now - datetime.timedelta(days=self.retention_days)).isoformat()
+
+    def run_once(self, now: datetime.datetime = None) -> dict:
+        """Archive and delete expired entries, prune old archives and reclaim free pages."""
+        now = now or datetime.datetime.utcnow()
+        with self._lock:
+            archived = self.archive_expired(self.cutoff(now))
+            pruned = self.prune_archives(now)
+            freed = self.compact() if archived else 0
+            self._last_run = {
+                "at": now.isoformat(),
+                "archived": archived,
+                "archives_pruned": pruned,
+                "pages_freed": freed,
+            }
+            return dict(self._last_run)
+
+    def archive_expired(self, cutoff: str) -> int:
+        """Move entries with timestamp < cutoff into their monthly archives; return how many moved."""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        moved = 0
+        while not self._stopping.is_set():
+            with self.store.reader() as conn:
+                rows = conn.execute(
+                    f"SELECT {', '.join(MEMORY_COLUMNS)} FROM memory WHERE timestamp < ? ORDER BY id LIMIT ?",
+                    (cutoff, self.batch_size),
+                ).fetchall()
+            if not rows:
+                break
+            entries = [decode_row(MEMORY_COLUMNS, row) for row in rows]
+            self._append_to_archives(entries)
+            self.store.delete_entries([entry["id"] for entry in entries])
+            moved += len(entries)
+        return moved
+
+    def _append_to_archives(self, entries: list):
+        partitions = {}
+        for entry in entries:
+            partitions.setdefault(partition_name(entry["timestamp"]), []).append(entry)
+        for partition, items in partitions.items():
+            # Appending writes a new gzip member; readers see one continuous stream
+            with open(archive_path(partition, self.archive_dir), "ab") as raw:
+                with gzip.GzipFile(fileobj=raw, mode="ab") as out:
+                    for entry in items:
+                        out.write(json.dumps(entry, ensure_ascii=False).encode("utf-8") + b"\n")
+                raw.flush()
+                os.fsync(raw.fileno())
+
+    def prune_archives(self, now: datetime.datetime = None) -> int:
+        if MEMORY_ARCHIVE_RETENTION_DAYS <= 0 or not os.path.isdir(self.archive_dir):
+            return 0
+        now = now or datetime.datetime.utcnow()
+        oldest = partition_name((now - datetime.timedelta(days=MEMORY_ARCHIVE_RETENTION_DAYS)).isoformat())
+        pruned = 0
+        for name in os.listdir(self.archive_dir):
+            if not (name.startswith("memory-") and name.endswith(".ndjson.gz")):
+                continue
+            partition = name[len("memory-"):-len(".ndjson.gz")]
+            if partition != "undated" and partition < oldest:
+                os.remove(os.path.join(self.archive_dir, name))
+                pruned += 1
+        return pruned
+
+    def compact(self) -> int:
+        """Return up to MEMORY_VACUUM_PAGES free pages to the filesystem."""
+        return self.store.incremental_vacuum(MEMORY_VACUUM_PAGES)
+
+    def stats(self) -> dict:
+        partitions = []
+        if os.path.isdir(self.archive_dir):
+            partitions = sorted(
+                name[len("memory-"):-len(".ndjson.gz")] for name in os.listdir(self.archive_dir)
+                if name.startswith("memory-") and name.endswith(".ndjson.gz")
+            )
+        return {
+            "retention_days": self.retention_days,
+            "archive_dir": self.archive_dir,
+            "archived_partitions": partitions,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "last_run": dict(self._last_run),
+        }
+
+
+memory_retention = RetentionManager(memory_store)
@@ -0,0 +1,55 @@
+# app/memory/search.py
+
+import os
+import re
+
+# Characters of document text indexed per entry
+MEMORY_SEARCH_MAX_CHARS = int(os.getenv("MEMORY_SEARCH_MAX_CHARS", "20000"))
+MEMORY_SEARCH_MAX_RESULTS = int(os.getenv("MEMORY_SEARCH_MAX_RESULTS", "100"))
+
+CREATE_FTS = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS memory_fts USING fts5(
+        sender, issue, body, tokenize = 'porter unicode61'
+    )
+'''
+# rowid is the memory id, so hits join straight back to the memory table
+INSERT_FTS = 'INSERT INTO memory_fts (rowid, sender, issue, body) VALUES (?, ?, ?, ?)'
+DELETE_FTS = 'DELETE FROM memory_fts WHERE rowid = ?'
+SEARCH_SQL = '''
+    SELECT memory.id, memory.timestamp, memory.source, memory.format, memory.intent, memory.tone,
+           bm25(memory_fts, 2.0, 4.0, 1.0) AS score,
+           snippet(memory_fts, -1, '[', ']', '…', 16) AS snippet
+    FROM memory_fts JOIN memory ON memory.id = memory_fts.rowid
+    WHERE memory_fts MATCH ? {filters}
+    ORDER BY score
+    LIMIT ? OFFSET ?
+'''
+SEARCH_COLUMNS = ["id", "timestamp", "source", "format", "intent", "tone", "score", "snippet"]
+
+
+def search_fields(agent_data: dict, search_text: str = ""):
+    """Return the (sender, issue, body) to index for an entry, or None if it has no text.
+
+    Emails index their sender and issue; PDFs index the extracted text passed in
+    as search_text, since the agent output does not keep it.
+    """
+    sender = agent_data.get("sender") or ""
+    issue = agent_data.get("issue") or ""
+    body = (search_text or "")[:MEMORY_SEARCH_MAX_CHARS]
+    if not (sender or issue or body):
+        return None
+    return str(sender), str(issue)[:MEMORY_SEARCH_MAX_CHARS], body
+
+
+def build_match_query(query: str) -> str:
+    """Turn free text into an FTS5 query matching all terms, so user input cannot break the syntax.
+
+    A trailing * on a term is kept as a prefix search.
+    """
+    terms = []
+    for term in re.findall(r'[^\s"]+', query):
+        prefix = term.endswith("*")
+        term = term.rstrip("*")
+        if term:
+            terms.append(f'"{term}"' + ("*" if prefix else ""))
+    return " ".join(terms)
@@ -0,0 +1,222 @@
+# app/memory/write_behind.py
+
+import asyncio
+import concurrent.futures
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from memory.memory_store import memory_store, make_entry, make_action_entry
+
+# A batch is committed once it holds this many entries or its oldest entry is this old
+MEMORY_FLUSH_BATCH_SIZE = int(os.getenv("MEMORY_FLUSH_BATCH_SIZE", "256"))
+MEMORY_FLUSH_INTERVAL = float(os.getenv("MEMORY_FLUSH_INTERVAL", "0.05"))
+# Entries allowed to wait for the writer, and how long a request waits for room
+MEMORY_QUEUE_SIZE = int(os.getenv("MEMORY_QUEUE_SIZE", "10000"))
+MEMORY_ENQUEUE_TIMEOUT = float(os.getenv("MEMORY_ENQUEUE_TIMEOUT", "2"))
+FLUSH_RETRIES = 3
+
+
+class MemoryQueueFull(Exception):
+    """Raised when the write-behind queue stays full past the enqueue timeout."""
+
+
+class MemoryWriteFailed(Exception):
+    """Raised to a request waiting on an entry the writer could not commit."""
+
+
+class InvalidMemoryEntry(ValueError):
+    """Raised when an entry cannot be stored, e.g. text that is not valid UTF-8 (a lone surrogate)."""
+
+
+def validate_entry(entry: dict):
+    """Reject an entry SQLite would refuse, so the request that made it gets the error instead of its batch."""
+    try:
+        json.dumps(entry, ensure_ascii=False).encode("utf-8")
+    except (TypeError, ValueError) as e:
+        raise InvalidMemoryEntry(f"Entry cannot be stored: {e}")
+
+
+class WriteBehindWriter:
+    """Background thread that commits queued memory entries in batched transactions.
+
+    Queue items are (entry, future); the future, when a caller asked for one,
+    is resolved once the entry's transaction has committed or it was dropped.
+    """
+
+    def __init__(self, store, batch_size: int = MEMORY_FLUSH_BATCH_SIZE,
+                 flush_interval: float = MEMORY_FLUSH_INTERVAL, max_queue: int = MEMORY_QUEUE_SIZE):
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stopping = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._counters = {"enqueued": 0, "written": 0, "batches": 0, "dropped": 0, "rejected": 0}
+
+    def _count(self, key: str, delta: int = 1):
+        with self._lock:
+            self._counters[key] += delta
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="memory-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 30):
+        """Stop accepting work and flush everything still queued."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        # Anything left (e.g. the thread died) is written synchronously
+        self._drain_remaining()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and not self._stopping.is_set()
+
+    def submit(self, entry: dict, timeout: float = MEMORY_ENQUEUE_TIMEOUT):
+        """Queue an entry, blocking up to timeout for room. Writes inline if the writer is not running."""
+        validate_entry(entry)
+        if not self.running:
+            self.store.store_entries([entry])
+            return
+        try:
+            self._queue.put((entry, None), timeout=timeout)
+        except queue.Full:
+            self._count("rejected")
+            raise MemoryQueueFull("Memory write queue is full.")
+        self._count("enqueued")
+
+    async def submit_async(self, entry: dict, timeout: float = MEMORY_ENQUEUE_TIMEOUT, wait: bool = False):
+        """Queue an entry without blocking the event loop, waiting up to timeout for room.
+
+        With wait, return only once the entry is committed (its batch still
+        shares one transaction), raising MemoryWriteFailed if it was dropped.
+        """
+        validate_entry(entry)
+        if not self.running:
+            await asyncio.to_thread(self.store.store_entries, [entry])
+            return
+        committed = concurrent.futures.Future() if wait else None
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self._queue.put_nowait((entry, committed))
+                break
+            except queue.Full:
+                if time.monotonic() >= deadline:
+                    self._count("rejected")
+                    raise MemoryQueueFull("Memory write queue is full.")
+                await asyncio.sleep(0.01)
+        self._count("enqueued")
+        if committed is not None:
+            await asyncio.wrap_future(committed)
+
+    def _next_batch(self) -> list:
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch: list):
+        """Commit a batch of (entry, future) items and resolve their futures."""
+        try:
+            self._write([entry for entry, _ in batch])
+        except sqlite3.OperationalError as e:
+            # The database itself is failing (locked, full); splitting the batch would not help
+            self._drop(batch, e)
+        except Exception as e:
+            if len(batch) == 1:
+                self._drop(batch, e)
+                return
+            # An entry the database rejects is dropped on its own, not with the rest of its batch
+            for item in batch:
+                self._flush([item])
+        else:
+            for _, committed in batch:
+                if committed is not None:
+                    committed.set_result(True)
+
+    def _drop(self, batch: list, error: Exception):
+        self._count("dropped", len(batch))
+        for _, committed in batch:
+            if committed is not None:
+                committed.set_exception(MemoryWriteFailed(f"Memory entry was not stored: {error}"))
+
+    def _write(self, batch: list):
+        """Commit batch, retrying only errors that may clear up (a locked or busy database)."""
+        for attempt in range(1, FLUSH_RETRIES + 1):
+            try:
+                self.store.store_entries(batch)
+                break
+            except sqlite3.OperationalError as e:
+                print(f"Error flushing {len(batch)} memory entries (attempt {attempt}):", e)
+                if attempt == FLUSH_RETRIES:
+                    raise
+                time.sleep(0.1 * attempt)
+            except Exception as e:
+                print(f"Error flushing {len(batch)} memory entries:", e)
+                raise
+        self._count("written", len(batch))
+        self._count("batches")
+
+    def _drain_remaining(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+        if batch:
+            self._flush(batch)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+        return {"queued": self._queue.qsize(), "running": self.running, **counters}
+
+
+memory_writer = WriteBehindWriter(memory_store)
+
+
+async def enqueue_entry(source: str, classification: dict, agent_data: dict, actions: dict,
+                        search_text: str = "", fingerprint: int = None, outbox: list = None):
+    """Queue a memory entry, and the outbox actions committed with it, for the background writer.
+
+    An entry that carries outbox actions is awaited until it is committed, so
+    a route never reports an action that could still be lost from the queue.
+    """
+    await memory_writer.submit_async(
+        make_entry(source, classification, agent_data, actions, search_text, fingerprint, outbox),
+        wait=bool(outbox),
+    )
+
+
+def enqueue_action(action: dict):
+    """Queue a standalone outbox action without blocking; safe to call from any thread."""
+    memory_writer.submit(make_action_entry(action), timeout=0)
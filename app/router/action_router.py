@@ -1,73 +1,83 @@
 # app/agents/action_router.py
 
-import requests
 import datetime
-from utils.internal_actions import escalate_crm, risk_alert, log_alert
+from router.dispatcher import dispatch_action
+from router.rules import rule_engine
 
-ACTION_ENDPOINTS = {
-    "escalate": "http://localhost:8000/crm/escalate",
-    "risk_alert": "http://localhost:8000/risk_alert",
-    "log": "http://localhost:8000/log"
+# Name each dispatched action is reported under in actions_triggered
+ACTION_LABELS = {
+    "escalate": "escalate",
+    "log": "log_alert",
+    "risk_alert": "risk_alert",
 }
 
-def route_action(agent_data: dict, classification: dict) -> dict:
+def propose_router_actions(agent_data: dict, classification: dict, fmt: str, trace: list) -> list:
+    """Proposals from the routing rules (router/rules.json) that match this item."""
+    rules = rule_engine.rules
+    matched = rules.match(fmt, agent_data, classification)
+    context = {"agent": agent_data, "classification": classification}
+    proposals = []
+    for rule in matched:
+        proposals.append({"action": rule.action, "payload": rule.build_payload(context), "reason": rule.reason})
+        if rule.trace:
+            trace.append(rule.trace)
+    if not matched and fmt in rules.no_match_trace:
+        trace.append(rules.no_match_trace[fmt])
+    return proposals
+
+def plan_actions(proposals: list) -> list:
+    """Merge proposals into one step per action, in first-proposed order.
+
+    Payloads are merged key by key, earlier proposals winning, so the step keeps
+    everything any proposer wanted to send.
+    """
+    steps = {}
+    for proposal in proposals:
+        step = steps.setdefault(proposal["action"], {"action": proposal["action"], "payload": {}, "proposed_by": [], "reasons": []})
+        for key, value in proposal.get("payload", {}).items():
+            step["payload"].setdefault(key, value)
+        if proposal["proposed_by"] not in step["proposed_by"]:
+            step["proposed_by"].append(proposal["proposed_by"])
+        if proposal.get("reason"):
+            step["reasons"].append(proposal["reason"])
+    return list(steps.values())
+
+def route_action(agent_data: dict, classification: dict, outbox: list = None) -> dict:
+    """Plan the item's actions from the agent's proposals and the routing rules, then dispatch each once.
+
+    The agent's proposed_actions are removed from agent_data and recorded in
+    the returned action_plan. Pass outbox to collect the actions so they are
+    committed with the memory entry (enqueue_entry(..., outbox=outbox));
+    without it each action is queued on its own.
+    """
     triggered_actions = []
     trace = []
 
     fmt = classification.get("format", "").strip().lower()
 
-    try:
-        # Email: escalation based on tone
-        if fmt == "email":
-            if agent_data.get("tone") in ["angry", "threatening", "escalated"]:
-                try:
-                    escalate_crm(agent_data)
-                    triggered_actions.append("escalate")
-                    trace.append("Escalation triggered for email (angry/threatening/escalated tone).")
-                except Exception as e:
-                    trace.append(f"Error escalating CRM: {e}")
-            else:
-                trace.append("No escalation needed for email.")
-
-        # JSON: anomaly alert
-        elif fmt == "json":
-            if agent_data.get("anomaly_flagged"):
-                try:
-                    if 'payload' in agent_data:
-                        log_data = {
-                            "anomaly": True,
-                            "details": agent_data.get("decision_trace", []),
-                            "payload": agent_data["payload"]
-                        }
-                        log_alert(log_data)
-                    else:
-                        log_alert(agent_data)
-                    triggered_actions.append("log_alert")
-                    trace.append("Log alert triggered for JSON anomaly.")
-                except Exception as e:
-                    trace.append(f"Error logging alert: {e}")
-            else:
-                trace.append("No anomaly detected in JSON.")
-
-        # PDF: flag high-value invoice or compliance
-        elif fmt == "pdf":
-            if agent_data.get("risk_triggered"):
-                try:
-                    risk_alert(agent_data)
-                    triggered_actions.append("risk_alert")
-                    trace.append("Risk alert triggered for PDF (invoice > 10,000 or compliance term found).")
-                except Exception as e:
-                    trace.append(f"Error sending risk alert: {e}")
-            else:
-                trace.append("No risk triggered for PDF.")
+    agent_name = agent_data.get("agent", "agent")
+    proposals = [dict(proposal, proposed_by=agent_name) for proposal in agent_data.pop("proposed_actions", [])]
+    proposals += [dict(proposal, proposed_by="action_router") for proposal in propose_router_actions(agent_data, classification, fmt, trace)]
+    plan = plan_actions(proposals)
 
-    except requests.RequestException as e:
-        triggered_actions.append(f"error: {str(e)}")
-        trace.append(f"Error during action routing: {str(e)}")
+    for step in plan:
+        try:
+            dispatch_action(step["action"], step["payload"], outbox)
+            triggered_actions.append(ACTION_LABELS.get(step["action"], step["action"]))
+        except Exception as e:
+            trace.append(f"Error dispatching {step['action']}: {e}")
+    if plan:
+        trace.append("Action plan: " + "; ".join(
+            f"{step['action']} (proposed by {', '.join(step['proposed_by'])})" for step in plan
+        ))
 
     return {
         "agent": "action_router",
         "timestamp": datetime.datetime.utcnow().isoformat(),
         "actions_triggered": triggered_actions,
+        "action_plan": [
+            {"action": step["action"], "proposed_by": step["proposed_by"], "reasons": step["reasons"]}
+            for step in plan
+        ],
         "decision_trace": trace
     }
@@ -0,0 +1,271 @@
+# app/router/dispatcher.py
+
+import asyncio
+import os
+import random
+import time
+import httpx
+from memory.memory_store import memory_store
+from memory.outbox import make_action
+from memory.write_behind import enqueue_action
+from utils.executors import run_blocking
+from utils.internal_actions import escalate_crm, risk_alert, log_alert
+
+# "inline" calls the in-process handlers in utils/internal_actions.py, "http" posts to ACTION_ENDPOINTS
+ACTION_DISPATCH_MODE = os.getenv("ACTION_DISPATCH_MODE", "inline").lower()
+ACTION_BASE_URL = os.getenv("ACTION_BASE_URL", "http://localhost:8000").rstrip("/")
+ACTION_ENDPOINTS = {
+    "escalate": f"{ACTION_BASE_URL}/crm/escalate",
+    "risk_alert": f"{ACTION_BASE_URL}/risk_alert",
+    "log": f"{ACTION_BASE_URL}/log",
+}
+ACTION_HANDLERS = {
+    "escalate": escalate_crm,
+    "risk_alert": risk_alert,
+    "log": log_alert,
+}
+
+# Outbox rows leased per delivery batch, idle poll interval, and how long a lease lasts
+ACTION_BATCH_SIZE = int(os.getenv("ACTION_BATCH_SIZE", "100"))
+ACTION_POLL_INTERVAL = float(os.getenv("ACTION_POLL_INTERVAL", "0.25"))
+ACTION_LEASE = float(os.getenv("ACTION_LEASE", "60"))
+# Calls in flight to any one endpoint at a time
+ACTION_ENDPOINT_CONCURRENCY = int(os.getenv("ACTION_ENDPOINT_CONCURRENCY", "4"))
+ACTION_HTTP_TIMEOUT = float(os.getenv("ACTION_HTTP_TIMEOUT", "5"))
+# Delivery attempts per action, with full-jitter exponential backoff between them
+ACTION_MAX_ATTEMPTS = int(os.getenv("ACTION_MAX_ATTEMPTS", "5"))
+ACTION_RETRY_BASE = float(os.getenv("ACTION_RETRY_BASE", "0.2"))
+ACTION_RETRY_MAX = float(os.getenv("ACTION_RETRY_MAX", "10"))
+# Delivered outbox rows are kept this many seconds, and purged every ACTION_PURGE_INTERVAL seconds
+ACTION_OUTBOX_TTL = float(os.getenv("ACTION_OUTBOX_TTL", "604800"))
+ACTION_PURGE_INTERVAL = float(os.getenv("ACTION_PURGE_INTERVAL", "3600"))
+# Consecutive failures that open an endpoint's circuit, and how long it stays open
+ACTION_BREAKER_THRESHOLD = int(os.getenv("ACTION_BREAKER_THRESHOLD", "5"))
+ACTION_BREAKER_RESET = float(os.getenv("ACTION_BREAKER_RESET", "30"))
+
+
+class PermanentActionError(Exception):
+    """An action the endpoint rejected outright; retrying will not help."""
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an endpoint whose circuit is open."""
+
+
+class CircuitBreaker:
+    """Fails fast after repeated failures, then lets one trial call through after reset_timeout."""
+
+    def __init__(self, threshold: int = ACTION_BREAKER_THRESHOLD, reset_timeout: float = ACTION_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self.trial_in_flight):
+            raise CircuitOpen(f"circuit open, retry in {self.retry_after():.1f}s")
+        if state == "half_open":
+            self.trial_in_flight = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+def backoff_delay(attempt: int, base: float = ACTION_RETRY_BASE, cap: float = ACTION_RETRY_MAX) -> float:
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class ActionDispatcher:
+    """Delivers actions recorded in the durable action outbox.
+
+    Requests only write actions to the outbox, in the same transaction as their
+    memory entry. One loop task leases due rows in batches of
+    ACTION_BATCH_SIZE, delivers them concurrently (bounded per endpoint, behind
+    a circuit breaker) and records every outcome of the batch in one
+    transaction. Failed deliveries are rescheduled with jittered backoff until
+    ACTION_MAX_ATTEMPTS, so delivery is at-least-once; the idempotency key is
+    sent along for receivers to deduplicate. The same loop purges delivered
+    rows older than ACTION_OUTBOX_TTL every ACTION_PURGE_INTERVAL seconds.
+    """
+
+    def __init__(self, store, mode: str = ACTION_DISPATCH_MODE, batch_size: int = ACTION_BATCH_SIZE,
+                 poll_interval: float = ACTION_POLL_INTERVAL):
+        self.store = store
+        self.mode = mode
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._task = None
+        self._stopping = None
+        self._client = None
+        self._semaphores = {name: asyncio.Semaphore(ACTION_ENDPOINT_CONCURRENCY) for name in ACTION_HANDLERS}
+        self._breakers = {name: CircuitBreaker() for name in ACTION_HANDLERS}
+        self._counters = {"batches": 0, "delivered": 0, "retried": 0, "failed": 0, "purged": 0}
+        self._purge_at = time.monotonic()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.running:
+            return
+        self._stopping = asyncio.Event()
+        if self.mode == "http":
+            self._client = httpx.AsyncClient(
+                timeout=ACTION_HTTP_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=ACTION_ENDPOINT_CONCURRENCY * len(ACTION_ENDPOINTS),
+                    max_keepalive_connections=ACTION_ENDPOINT_CONCURRENCY * len(ACTION_ENDPOINTS),
+                ),
+            )
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 30):
+        """Keep delivering due actions for up to timeout seconds, then stop; the rest stay in the outbox."""
+        if not self.running:
+            return
+        self._stopping.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            print("Action dispatcher stopped with deliveries still in progress")
+        self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _run(self):
+        while True:
+            if time.monotonic() >= self._purge_at:
+                await self.purge_delivered()
+            try:
+                delivered_any = await self.deliver_batch()
+            except Exception as e:
+                print("Error delivering outbox batch:", e)
+                delivered_any = False
+            if delivered_any:
+                continue
+            if self._stopping.is_set():
+                return
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def purge_delivered(self):
+        self._purge_at = time.monotonic() + ACTION_PURGE_INTERVAL
+        try:
+            self._counters["purged"] += await run_blocking(self.store.purge_outbox, time.time() - ACTION_OUTBOX_TTL)
+        except Exception as e:
+            print("Error purging delivered outbox rows:", e)
+
+    async def deliver_batch(self) -> bool:
+        """Lease, deliver and settle one batch; returns False when nothing was due."""
+        rows = await run_blocking(self.store.claim_actions, self.batch_size, ACTION_LEASE)
+        if not rows:
+            return False
+        outcomes = await asyncio.gather(*(self._attempt(row) for row in rows))
+        delivered, retries, failures = [], [], []
+        for row, (outcome, error, delay) in zip(rows, outcomes):
+            if outcome == "delivered":
+                delivered.append(row["id"])
+            elif outcome == "deferred":
+                # Not attempted (circuit open), so the claim does not count as an attempt
+                retries.append((time.time() + delay, 1, error, row["id"]))
+            elif outcome == "failed" or row["attempts"] >= ACTION_MAX_ATTEMPTS:
+                failures.append((error, row["id"]))
+                print(f"Action {row['action']} ({row['idempotency_key']}) failed permanently:", error)
+            else:
+                retries.append((time.time() + backoff_delay(row["attempts"]), 0, error, row["id"]))
+        await run_blocking(self.store.finish_actions, delivered, retries, failures)
+        self._counters["batches"] += 1
+        self._counters["delivered"] += len(delivered)
+        self._counters["retried"] += len(retries)
+        self._counters["failed"] += len(failures)
+        return True
+
+    async def _attempt(self, row: dict):
+        """Try one delivery; returns (outcome, error, delay) with outcome delivered/retry/deferred/failed."""
+        action = row["action"]
+        breaker = self._breakers.get(action)
+        if breaker is None:
+            return "failed", f"Unknown action: {action}", 0
+        try:
+            breaker.before_call()
+        except CircuitOpen as e:
+            return "deferred", str(e), max(breaker.retry_after(), self.poll_interval)
+        try:
+            async with self._semaphores[action]:
+                await self._call(action, row["payload"], row["idempotency_key"])
+        except PermanentActionError as e:
+            breaker.record_success()
+            return "failed", str(e), 0
+        except Exception as e:
+            breaker.record_failure()
+            return "retry", str(e) or type(e).__name__, 0
+        breaker.record_success()
+        return "delivered", None, 0
+
+    async def _call(self, action: str, payload: dict, idempotency_key: str):
+        if self.mode != "http":
+            await run_blocking(ACTION_HANDLERS[action], payload)
+            return
+        response = await self._client.post(
+            ACTION_ENDPOINTS[action], json=payload, headers={"Idempotency-Key": idempotency_key}
+        )
+        if response.status_code >= 500 or response.status_code == 429:
+            raise httpx.HTTPStatusError(f"{response.status_code} from {action}", request=response.request, response=response)
+        if response.status_code >= 400:
+            raise PermanentActionError(f"{response.status_code} from {action}: {response.text[:200]}")
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "running": self.running,
+            **self._counters,
+            "outbox": self.store.outbox_stats(),
+            "circuits": {name: breaker.state for name, breaker in self._breakers.items()},
+        }
+
+
+action_dispatcher = ActionDispatcher(memory_store)
+
+
+def dispatch_action(action: str, payload: dict, outbox: list = None):
+    """Record an action for delivery.
+
+    With an outbox list (from a request that is about to store its memory
+    entry) the action is appended and committed together with the entry;
+    without one it is queued on its own through the write-behind writer.
+    """
+    if action not in ACTION_HANDLERS:
+        raise ValueError(f"Unknown action: {action}")
+    planned = make_action(action, payload)
+    if outbox is not None:
+        outbox.append(planned)
+    else:
+        enqueue_action(planned)
@@ -0,0 +1,245 @@
+# app/router/rules.py
+
+import datetime
+import json
+import os
+import threading
+import time
+
+# Routing rules file; edits are picked up without a restart
+ACTION_RULES_PATH = os.getenv("ACTION_RULES_PATH", os.path.join(os.path.dirname(__file__), "rules.json"))
+# Seconds between checks of the rules file's modification time
+ACTION_RULES_RELOAD_INTERVAL = float(os.getenv("ACTION_RULES_RELOAD_INTERVAL", "2"))
+
+# Condition operators: (field value, rule argument) -> bool
+OPERATORS = {
+    "eq": lambda value, arg: value == arg,
+    "ne": lambda value, arg: value != arg,
+    "in": lambda value, arg: value in arg,
+    "not_in": lambda value, arg: value not in arg,
+    "gt": lambda value, arg: value is not None and value > arg,
+    "gte": lambda value, arg: value is not None and value >= arg,
+    "lt": lambda value, arg: value is not None and value < arg,
+    "lte": lambda value, arg: value is not None and value <= arg,
+    "contains": lambda value, arg: value is not None and arg in value,
+    "truthy": lambda value, arg: bool(value) == bool(arg),
+    "exists": lambda value, arg: (value is not None) == bool(arg),
+}
+FIELD_ROOTS = ("agent", "classification")
+ANY_FORMAT = "*"
+
+
+def resolve_field(context: dict, path: str):
+    """Look up a dotted path such as agent.tone in {"agent": ..., "classification": ...}; None if absent."""
+    value = context
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def _hashable(value) -> bool:
+    return value is None or isinstance(value, (str, int, float, bool))
+
+
+class Rule:
+    """One compiled rule: conditions on agent/classification fields mapped to an action."""
+
+    def __init__(self, order: int, spec: dict, constants: dict):
+        self.order = order
+        self.name = spec.get("name") or f"rule_{order}"
+        self.action = spec.get("action")
+        if not isinstance(self.action, str) or not self.action:
+            raise ValueError(f"Rule {self.name}: missing action")
+        self.format = str(spec.get("format", ANY_FORMAT)).strip().lower()
+        self.reason = spec.get("reason", self.name)
+        self.trace = spec.get("trace")
+        self.payload = self._substitute(spec.get("payload", "$agent"), constants)
+        self.conditions = []
+        for field, condition in (spec.get("when") or {}).items():
+            if field.split(".", 1)[0] not in FIELD_ROOTS:
+                raise ValueError(f"Rule {self.name}: field {field} must start with agent. or classification.")
+            # A bare value is shorthand for {"eq": value}
+            if not isinstance(condition, dict):
+                condition = {"eq": condition}
+            for op, arg in condition.items():
+                if op not in OPERATORS:
+                    raise ValueError(f"Rule {self.name}: unknown operator {op}")
+                arg = self._substitute(arg, constants)
+                if op in ("in", "not_in"):
+                    if not isinstance(arg, list):
+                        raise ValueError(f"Rule {self.name}: {op} needs a list")
+                    arg = tuple(arg)
+                self.conditions.append((field, op, arg))
+
+    def _substitute(self, value, constants: dict):
+        """Replace "$name" with a constant; "$agent..."/"$classification..." stay as field references."""
+        if isinstance(value, dict):
+            return {key: self._substitute(item, constants) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._substitute(item, constants) for item in value]
+        if isinstance(value, str) and value.startswith("$"):
+            name = value[1:]
+            if name.split(".", 1)[0] in FIELD_ROOTS:
+                return value
+            if name not in constants:
+                raise ValueError(f"Rule {self.name}: unknown constant {value}")
+            return constants[name]
+        return value
+
+    def index_key(self):
+        """(field, values) of the first condition a hash index can serve, or None."""
+        for field, op, arg in self.conditions:
+            if op == "eq" and _hashable(arg):
+                return field, (arg,)
+            if op == "in" and all(_hashable(item) for item in arg):
+                return field, arg
+        return None
+
+    def matches(self, context: dict) -> bool:
+        for field, op, arg in self.conditions:
+            try:
+                if not OPERATORS[op](resolve_field(context, field), arg):
+                    return False
+            except TypeError:
+                return False
+        return True
+
+    def build_payload(self, context: dict):
+        return self._render(self.payload, context)
+
+    def _render(self, value, context: dict):
+        if isinstance(value, dict):
+            return {key: self._render(item, context) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._render(item, context) for item in value]
+        if isinstance(value, str) and value.startswith("$"):
+            return resolve_field(context, value[1:])
+        return value
+
+
+class RuleSet:
+    """Rules compiled into a dispatch table: format -> (rules to scan, field -> value -> rules).
+
+    A rule is filed under its format (or "*") and, when it has an eq/in
+    condition, under that condition's field and values; only rules left
+    without one are scanned for every item. Matching therefore costs the
+    candidate rules for the item's format and field values, not the whole set.
+    """
+
+    def __init__(self, config: dict, source: str = None, mtime: float = None):
+        if not isinstance(config.get("rules", []), list):
+            raise ValueError("rules must be a list")
+        self.constants = dict(config.get("constants") or {})
+        self.no_match_trace = dict(config.get("no_match_trace") or {})
+        self.rules = [Rule(order, spec, self.constants) for order, spec in enumerate(config.get("rules", []))]
+        self.source = source
+        self.mtime = mtime
+        self.loaded_at = datetime.datetime.utcnow().isoformat()
+        self.table = {}
+        for rule in self.rules:
+            scan, indexed = self.table.setdefault(rule.format, ([], {}))
+            key = rule.index_key()
+            if key is None:
+                scan.append(rule)
+                continue
+            field, values = key
+            by_value = indexed.setdefault(field, {})
+            for value in dict.fromkeys(values):
+                by_value.setdefault(value, []).append(rule)
+
+    def candidates(self, fmt: str, context: dict) -> list:
+        found = []
+        for key in (fmt, ANY_FORMAT):
+            if key not in self.table:
+                continue
+            scan, indexed = self.table[key]
+            found.extend(scan)
+            for field, by_value in indexed.items():
+                value = resolve_field(context, field)
+                if _hashable(value):
+                    found.extend(by_value.get(value, ()))
+        found.sort(key=lambda rule: rule.order)
+        return found
+
+    def match(self, fmt: str, agent_data: dict, classification: dict) -> list:
+        """Rules matching an item, in file order."""
+        context = {"agent": agent_data, "classification": classification}
+        return [rule for rule in self.candidates(fmt, context) if rule.matches(context)]
+
+
+class RuleEngine:
+    """Holds the current RuleSet and swaps in a recompiled one when the rules file changes.
+
+    The file is compiled once at startup (a broken file fails startup). After
+    that its mtime is checked at most every reload_interval seconds; a file
+    that fails to load is reported and the previous rules stay in force.
+    """
+
+    def __init__(self, path: str = ACTION_RULES_PATH, reload_interval: float = ACTION_RULES_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._checked_at = time.monotonic()
+        self._counters = {"reloads": 0, "reload_errors": 0}
+        self._last_error = None
+        self._failed_mtime = None
+        self._rules = self._load()
+
+    def _load(self) -> RuleSet:
+        mtime = os.path.getmtime(self.path)
+        with open(self.path, "r", encoding="utf-8") as f:
+            return RuleSet(json.load(f), self.path, mtime)
+
+    @property
+    def rules(self) -> RuleSet:
+        if time.monotonic() - self._checked_at >= self.reload_interval:
+            self.reload()
+        return self._rules
+
+    def reload(self, force: bool = False) -> bool:
+        """Recompile the rules if the file changed (or force); returns whether new rules were swapped in."""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            mtime = None
+            try:
+                mtime = os.path.getmtime(self.path)
+                # Unchanged, or the same broken edit that already failed to load
+                if not force and mtime in (self._rules.mtime, self._failed_mtime):
+                    return False
+                rules = self._load()
+            except Exception as e:
+                self._failed_mtime = mtime
+                self._counters["reload_errors"] += 1
+                self._last_error = str(e)
+                print("Error reloading action rules, keeping previous rules:", e)
+                return False
+            self._rules = rules
+            self._counters["reloads"] += 1
+            self._last_error = None
+            return True
+
+    def match(self, fmt: str, agent_data: dict, classification: dict) -> list:
+        return self.rules.match(fmt, agent_data, classification)
+
+    def constant(self, name: str):
+        return self.rules.constants[name]
+
+    def stats(self) -> dict:
+        rules = self._rules
+        return {
+            "path": rules.source,
+            "rules": len(rules.rules),
+            "loaded_at": rules.loaded_at,
+            **self._counters,
+            "last_error": self._last_error,
+        }
+
+
+rule_engine = RuleEngine()
+
+
+def rule_constant(name: str):
+    """A shared value from the rules file's constants (e.g. invoice_risk_threshold), current after reloads."""
+    return rule_engine.constant(name)
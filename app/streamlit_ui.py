@@ -88,12 +88,13 @@ st.markdown("""
 
 # API Configuration
 API_BASE = st.sidebar.text_input("🔗 API Base URL", value="http://127.0.0.1:8000")
+MEMORY_PAGE_SIZE = 50
 
 # Connection status check
 def check_api_connection(retries=1, delay=60):
     for _ in range(retries):
         try:
-            response = requests.get(f"{API_BASE}/memory", timeout=10)
+            response = requests.get(f"{API_BASE}/memory", params={"limit": 1}, timeout=10)
             if response.status_code == 200:
                 return True
         except:
@@ -511,9 +512,9 @@ with col2:
     
     if fetch_needed:
         try:
-            memory_response = requests.get(f"{API_BASE}/memory", timeout=30)
+            memory_response = requests.get(f"{API_BASE}/memory", params={"limit": MEMORY_PAGE_SIZE}, timeout=30)
             if memory_response.status_code == 200:
-                memory_data = memory_response.json()
+                memory_data = memory_response.json().get("entries", [])
                 st.session_state['cached_memory_data'] = memory_data
                 st.session_state['last_memory_fetch'] = now
             else:
@@ -527,51 +528,58 @@ with col2:
             memory_data = None
     # If not fetching, use cached data
     
+    if fetch_needed:
+        try:
+            stats_response = requests.get(f"{API_BASE}/memory/stats", timeout=30)
+            if stats_response.status_code == 200:
+                st.session_state['cached_memory_stats'] = stats_response.json()
+        except requests.RequestException:
+            pass
+    memory_stats = st.session_state.get('cached_memory_stats')
+
+    if memory_stats and memory_stats.get('total'):
+        # Counters are maintained server-side, so this costs the same at any history size
+        st.markdown(f"**📈 Processing Summary** ({memory_stats['total']} entries):")
+        for source, count in sorted(memory_stats.get('source', {}).items(), key=lambda item: item[1], reverse=True):
+            st.markdown(f"- **{source}**: {count} entries")
+        risk_count = memory_stats.get('risk', {}).get('true', 0)
+        anomaly_count = memory_stats.get('anomaly', {}).get('true', 0)
+        st.markdown(f"⚠️ Risk triggered: **{risk_count}** | 🚨 Anomalies: **{anomaly_count}**")
+        if memory_stats.get('hourly'):
+            st.bar_chart(pd.Series(memory_stats['hourly'], name="entries"))
+
     if memory_data:
-        st.success(f"📊 {len(memory_data)} entries in memory")
+        st.success(f"📊 Showing the latest {len(memory_data)} entries")
         # Process memory data
         if isinstance(memory_data, list) and len(memory_data) > 0:
-            # Create summary statistics
-            sources = []
-            timestamps = []
-            for entry in memory_data:
-                if isinstance(entry, dict):
-                    sources.append(entry.get('source', 'unknown'))
-                    # Try to extract timestamp if available
-                    if 'timestamp' in entry:
-                        timestamps.append(entry['timestamp'])
-            if sources:
-                source_counts = pd.Series(sources).value_counts()
-                st.markdown("**📈 Processing Summary:**")
-                for source, count in source_counts.items():
-                    st.markdown(f"- **{source}**: {count} entries")
             # Show recent entries
             st.markdown("**🕒 Recent Entries:**")
-            recent_entries = memory_data[-5:] if len(memory_data) > 5 else memory_data
-            for i, entry in enumerate(reversed(recent_entries)):
-                entry_num = len(memory_data) - i
+            # Entries arrive newest first
+            for entry in memory_data[:5]:
+                entry_num = entry.get('id', '?') if isinstance(entry, dict) else '?'
                 if isinstance(entry, dict):
                     source = entry.get('source', 'unknown')
                     # Create a summary for the expander
                     summary = f"Entry {entry_num}: {source}"
                     # Add risk indicators if available
-                    if 'classification_result' in entry:
-                        class_result = entry['classification_result']
+                    if isinstance(entry.get('classification'), dict):
+                        class_result = entry['classification']
                         if class_result.get('anomaly_flagged'):
                             summary += " 🚨"
                         if class_result.get('risk_triggered'):
                             summary += " ⚠️"
                     with st.expander(summary):
                         # Show key information first
-                        if 'classification_result' in entry:
-                            class_result = entry['classification_result']
+                        if isinstance(entry.get('classification'), dict):
+                            class_result = entry['classification']
                             st.markdown("**Status Overview:**")
                             anomaly_status = "🚨 **Anomaly Detected**" if class_result.get('anomaly_flagged') else "✅ **No Anomaly**"
                             risk_status = "⚠️ **Risk Triggered**" if class_result.get('risk_triggered') else "✅ **No Risk**"
                             st.markdown(f"{anomaly_status} | {risk_status}")
                         # Show actions if any
-                        if 'actions' in entry and entry['actions']:
-                            st.markdown(f"**Actions:** {', '.join(entry['actions'])}")
+                        actions_triggered = (entry.get('actions') or {}).get('actions_triggered', []) if isinstance(entry.get('actions'), dict) else []
+                        if actions_triggered:
+                            st.markdown(f"**Actions:** {', '.join(actions_triggered)}")
                         # Show full entry
                         st.json(entry)
                 else:
@@ -603,7 +611,9 @@ with col1:
 with col2:
     st.markdown("""
     **📊 System Endpoints:**
-    - `GET /memory` - View system memory
+    - `GET /memory` - Page through system memory (filters: source, intent, tone, risk, anomaly, since, until)
+    - `GET /memory/stats` - Entry counts by source, intent, tone, action and hour
+    - `GET /memory/export` - Stream the memory log as NDJSON
     - `POST /crm/escalate` - CRM escalation
     - `POST /risk_alert` - Risk alert system
     - `POST /log` - Log alert system
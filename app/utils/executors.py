@@ -0,0 +1,100 @@
+# app/utils/executors.py
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Threads available for blocking work (SQLite, PyMuPDF) run off the event loop
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", "8"))
+# Tasks allowed to wait for a free thread before new submissions are rejected
+BLOCKING_MAX_QUEUE = int(os.getenv("BLOCKING_MAX_QUEUE", "256"))
+
+
+class PoolSaturated(Exception):
+    """Raised when a worker pool's queue is full."""
+
+
+class WorkerPool:
+    """Bounded thread pool with a queue-depth limit and task metrics.
+
+    Timeouts in run() hand control back to the caller immediately: a task that
+    has not started yet is cancelled, one that is already running is left to
+    finish in the background and counted as timed out.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._counters = {
+            "active": 0,
+            "queued": 0,
+            "rejected": 0,
+            "completed": 0,
+            "failed": 0,
+            "timed_out": 0,
+        }
+
+    def _count(self, **deltas):
+        with self._lock:
+            for key, delta in deltas.items():
+                self._counters[key] += delta
+
+    def submit(self, func, *args, **kwargs):
+        """Queue func on the pool, raising PoolSaturated if the queue is full."""
+        with self._lock:
+            if self._counters["queued"] >= self.max_queue:
+                self._counters["rejected"] += 1
+                raise PoolSaturated(f"{self.name} pool queue is full ({self.max_queue} waiting)")
+            self._counters["queued"] += 1
+
+        def _task():
+            self._count(queued=-1, active=1)
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                self._count(active=-1, failed=1)
+                raise
+            self._count(active=-1, completed=1)
+            return result
+
+        future = self._executor.submit(_task)
+        # A task cancelled before it started never runs _task, so release its queue slot here
+        future.add_done_callback(lambda f: f.cancelled() and self._count(queued=-1))
+        return future
+
+    async def run(self, func, *args, timeout: float = None, **kwargs):
+        """Run func on the pool and await its result, giving up after timeout seconds."""
+        future = self.submit(func, *args, **kwargs)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            self._count(timed_out=1)
+            raise
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+        return {"name": self.name, "max_workers": self.max_workers, "max_queue": self.max_queue, **counters}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+blocking_pool = WorkerPool("blocking", BLOCKING_WORKERS, BLOCKING_MAX_QUEUE)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call on the shared bounded pool and await its result."""
+    return await blocking_pool.run(func, *args, **kwargs)
+
+
+def get_pool_stats() -> dict:
+    return {blocking_pool.name: blocking_pool.stats()}
+
+
+def shutdown_pools():
+    blocking_pool.shutdown()
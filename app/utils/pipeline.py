@@ -0,0 +1,50 @@
+# app/utils/pipeline.py
+
+import asyncio
+import os
+from agents.llm_client import LLMOverloaded
+from utils.executors import PoolSaturated
+
+CLASSIFIER_TIMEOUT = float(os.getenv("CLASSIFIER_TIMEOUT", "10"))
+AGENT_TIMEOUT = float(os.getenv("AGENT_TIMEOUT", "30"))
+BATCH_CLASSIFIER_TIMEOUT = float(os.getenv("BATCH_CLASSIFIER_TIMEOUT", "60"))
+
+
+class StageError(Exception):
+    """Raised when a pipeline stage times out or fails."""
+
+    def __init__(self, stage: str, reason: str):
+        super().__init__(f"{stage} stage {reason}")
+        self.stage = stage
+        self.reason = reason
+
+
+async def run_stage(name: str, awaitable, timeout: float = None):
+    """Await a stage coroutine with a timeout, wrapping failures in StageError.
+
+    Overload errors pass through unwrapped so the app can answer them with 503.
+    """
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise StageError(name, "timed out")
+    except (StageError, PoolSaturated, LLMOverloaded):
+        raise
+    except Exception as e:
+        raise StageError(name, f"failed: {e}")
+
+
+async def run_concurrently(stages: dict) -> dict:
+    """Await independent stages together and return their results by name.
+
+    If any stage fails, the remaining ones are cancelled and the error is re-raised.
+    """
+    tasks = {name: asyncio.ensure_future(stage) for name, stage in stages.items()}
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+    return {name: task.result() for name, task in tasks.items()}
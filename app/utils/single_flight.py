@@ -0,0 +1,45 @@
+# app/utils/single_flight.py
+
+import asyncio
+import copy
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key onto one in-flight task.
+
+    The first caller for a key starts the work; callers arriving while it is
+    pending await the same task and each receive a copy of its result (or its
+    exception). The key is forgotten as soon as the task finishes, so later
+    calls start fresh. Must be used from a single event loop.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self._stats = {"calls": 0, "executions": 0, "collapsed": 0, "failures": 0}
+
+    async def do(self, key, factory):
+        """Return the result of factory() for key, sharing it with concurrent callers."""
+        self._stats["calls"] += 1
+        task = self._inflight.get(key)
+        if task is None:
+            self._stats["executions"] += 1
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self._stats["collapsed"] += 1
+        # One caller timing out or disconnecting must not cancel the call for the others
+        result = await asyncio.shield(task)
+        return copy.deepcopy(result)
+
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is not None:
+            self._stats["failures"] += 1
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        stats["in_flight"] = len(self._inflight)
+        stats["collapsed_ratio"] = round(stats["collapsed"] / stats["calls"], 4) if stats["calls"] else 0.0
+        return stats
@@ -0,0 +1,48 @@
+# app/utils/uploads.py
+
+import os
+import hashlib
+import tempfile
+import aiofiles
+
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# Directory for spooled uploads; defaults to the system temp directory
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload grows past its size limit while being spooled."""
+
+
+async def spool_upload(upload, max_bytes: int, suffix: str = "") -> dict:
+    """Stream an UploadFile to a temp file in chunks, hashing as it is written.
+
+    Returns {"path", "size", "sha256"}; the caller owns the file and must remove
+    it with discard_upload(). Nothing is left on disk if the limit is exceeded.
+    """
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=UPLOAD_SPOOL_DIR)
+    os.close(fd)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(path, "wb") as out:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes.")
+                digest.update(chunk)
+                await out.write(chunk)
+    except BaseException:
+        discard_upload(path)
+        raise
+    return {"path": path, "size": size, "sha256": digest.hexdigest()}
+
+
+def discard_upload(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass